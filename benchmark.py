@@ -0,0 +1,355 @@
+"""Benchmark the upload -> process -> serve path of server.py on synthetic data.
+
+Usage: python benchmark.py [--fixtures hdf5,dicom,nifti] [--slices 200] [--size 256] [--output bench.json]
+
+Fixtures are generated locally in a scratch directory and driven through the
+Flask test client. Results are printed (or written) as JSON.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+FIXTURES = ('hdf5', 'dicom', 'nifti')
+
+
+def descendant_pids(root):
+    # Conversion workers are started by the forkserver, so they are grandchildren of this process
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat_file:
+                ppid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pending, found = [root], []
+    while pending:
+        pids = children.get(pending.pop(), [])
+        found += pids
+        pending += pids
+    return found
+
+
+def status_kb(pid, field):
+    try:
+        with open(f'/proc/{pid}/status') as status_file:
+            for line in status_file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class WorkerRssSampler(threading.Thread):
+    """Polls /proc for the RSS of every descendant process; RUSAGE_CHILDREN never sees the workers."""
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.available = os.path.isdir('/proc')
+        self.reset()
+
+    def reset(self):
+        self.peak_total_kb = 0
+        self.peak_process_kb = 0
+
+    def run(self):
+        while self.available and not self.stopped.wait(self.interval):
+            pids = descendant_pids(os.getpid())
+            self.peak_total_kb = max(self.peak_total_kb, sum(status_kb(pid, 'VmRSS') for pid in pids))
+            self.peak_process_kb = max([self.peak_process_kb] + [status_kb(pid, 'VmHWM') for pid in pids])
+
+    def stop(self):
+        self.stopped.set()
+
+
+def peak_rss_mb(sampler):
+    # ru_maxrss is reported in kilobytes on Linux; worker figures are sampled and None without /proc
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'workers_total': sampler.peak_total_kb / 1024.0 if sampler.available else None,
+        'worker_max': sampler.peak_process_kb / 1024.0 if sampler.available else None,
+    }
+
+
+def synthetic_slices(count, size, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    radius = np.hypot(x - size / 2.0, y - size / 2.0)
+    for index in range(count):
+        phantom = np.where(radius < size * (0.25 + 0.15 * np.sin(index / 10.0)), 1000.0, 0.0)
+        yield (phantom + rng.normal(0, 50, (size, size))).astype(np.int16)
+
+
+def write_hdf5_fixture(path, count, size):
+    import h5py
+
+    with h5py.File(path, 'w') as file:
+        images = file.create_dataset('train/X', shape=(count, size, size), dtype=np.int16, chunks=(min(count, 16), size, size))
+        for index, pixels in enumerate(synthetic_slices(count, size)):
+            images[index] = pixels
+        file.create_dataset('train/labels', data=np.arange(count) % 10)
+        file.create_dataset('train/features', data=np.random.default_rng(1).normal(size=(count, 64)).astype(np.float32))
+    return count
+
+
+def write_dicom_fixture(path, count, size):
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+    scratch = tempfile.mkdtemp()
+    study_uid, series_uid = generate_uid(), generate_uid()
+    series_folder = os.path.join(scratch, 'study', 'series1')
+    os.makedirs(series_folder)
+    for index, pixels in enumerate(synthetic_slices(count, size)):
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = CTImageStorage
+        file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        slice_path = os.path.join(series_folder, f'slice_{index:04d}.dcm')
+        ds = FileDataset(slice_path, {}, file_meta=file_meta, preamble=b'\0' * 128)
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = 'CT'
+        ds.PatientName = 'Benchmark^Synthetic'
+        ds.PatientID = 'BENCH0001'
+        ds.SeriesNumber = 1
+        ds.InstanceNumber = index + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(index)]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.SliceThickness = 1.0
+        ds.PixelSpacing = [1.0, 1.0]
+        ds.Rows, ds.Columns = pixels.shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleIntercept = -1024
+        ds.RescaleSlope = 1
+        ds.WindowCenter = 40
+        ds.WindowWidth = 400
+        ds.PixelData = pixels.tobytes()
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(slice_path, write_like_original=False)
+
+    zip_folder(scratch, path)
+    shutil.rmtree(scratch)
+    return count
+
+
+def write_nifti_fixture(path, count, size):
+    import nibabel as nib
+
+    scratch = tempfile.mkdtemp()
+    os.makedirs(os.path.join(scratch, 'study'))
+    volume = np.stack(list(synthetic_slices(count, size)), axis=-1)
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), os.path.join(scratch, 'study', 'volume.nii'))
+    zip_folder(scratch, path)
+    shutil.rmtree(scratch)
+    return count
+
+
+def zip_folder(folder, path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for root, dirs, files in os.walk(folder):
+            for file in files:
+                file_path = os.path.join(root, file)
+                zf.write(file_path, os.path.relpath(file_path, folder))
+
+
+FIXTURE_WRITERS = {
+    'hdf5': ('benchmark.h5', write_hdf5_fixture),
+    'dicom': ('benchmark_dicom.zip', write_dicom_fixture),
+    'nifti': ('benchmark_nifti.zip', write_nifti_fixture),
+}
+
+
+def timed(stages, name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    stages[name] = time.perf_counter() - start
+    return result
+
+
+def wait_for_job(client, job_id, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['state'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f'Job {job_id} did not finish within {timeout}s')
+
+
+def first_folder(client, upload_id, predicate):
+    pending = ['']
+    while pending:
+        path = pending.pop(0)
+        for name in client.get(f'/output-files?path={path}&upload_id={upload_id}').get_json():
+            child = f'{path}/{name}'.lstrip('/')
+            if predicate(name):
+                return child
+            if '.' not in name:
+                pending.append(child)
+    return None
+
+
+def run_fixture(client, name, file_path, slices, gallery_images, timeout, sampler):
+    stages = {}
+    sampler.reset()
+    size_bytes = os.path.getsize(file_path)
+
+    with open(file_path, 'rb') as file:
+        response = timed(stages, 'upload_s', client.post, '/upload',
+                         data={'file': (file, os.path.basename(file_path))}, content_type='multipart/form-data')
+    upload = response.get_json()
+    if response.status_code != 202:
+        raise RuntimeError(f'Upload failed: {upload}')
+    upload_id = upload['upload_id']
+
+    job = timed(stages, 'process_s', wait_for_job, client, upload['job_id'], timeout)
+    if job['state'] != 'done':
+        raise RuntimeError(f"Processing failed: {job['error']}")
+
+    timed(stages, 'list_s', client.get, f'/output-files?upload_id={upload_id}')
+
+    image_folder = first_folder(client, upload_id, lambda folder: folder.endswith('Images') or folder.startswith('imageNew'))
+    if image_folder:
+        urls = timed(stages, 'folder_images_s', client.get,
+                     f'/output-files/folder-images?folder={image_folder}&upload_id={upload_id}').get_json()
+        paths = [url.replace('http://127.0.0.1:5000', '') for url in urls[:gallery_images]]
+        start = time.perf_counter()
+        gallery_bytes = sum(len(client.get(path).data) for path in paths)
+        stages['gallery_s'] = time.perf_counter() - start
+        stages['gallery_bytes'] = gallery_bytes
+
+    meta_folder = first_folder(client, upload_id, lambda folder: folder.startswith('metaNew'))
+    if meta_folder:
+        timed(stages, 'metadata_query_s', client.get,
+              f'/output-files/folder-metadata?folder={meta_folder}&limit=100&upload_id={upload_id}')
+
+    volumes = client.get(f'/volumes?upload_id={upload_id}').get_json() or {}
+    if volumes:
+        volume_name = next(iter(volumes))
+        timed(stages, 'volume_mip_s', client.get, f'/volumes/{volume_name}/coronal/mip?upload_id={upload_id}')
+        timed(stages, 'volume_reformat_s', client.get,
+              f"/volumes/{volume_name}/sagittal/{volumes[volume_name]['axes']['sagittal'] // 2}?upload_id={upload_id}")
+
+    download_root = first_folder(client, upload_id, lambda folder: '.' not in folder)
+    if download_root:
+        start = time.perf_counter()
+        response = client.get(f'/output-files/download-folder?folder={download_root.split("/")[0]}&upload_id={upload_id}')
+        if response.status_code == 200:
+            stages['download_bytes'] = len(response.data)
+            stages['download_s'] = time.perf_counter() - start
+
+    processing = stages['upload_s'] + stages['process_s']
+    return {
+        'fixture': name,
+        'upload_id': upload_id,
+        'cached': upload['cached'],
+        'size_bytes': size_bytes,
+        'slices': slices,
+        'stages': stages,
+        # Populated when the server runs with METRICS_ENABLED=1
+        'server_stages': job.get('timings'),
+        'slices_per_second': slices / processing if processing else None,
+        'mb_per_second': size_bytes / (1024.0 * 1024.0) / processing if processing else None,
+        'peak_rss_mb': peak_rss_mb(sampler),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', default=','.join(FIXTURES), help='comma-separated subset of hdf5,dicom,nifti')
+    parser.add_argument('--slices', type=int, default=200, help='slices per fixture')
+    parser.add_argument('--size', type=int, default=256, help='slice width and height in pixels')
+    parser.add_argument('--gallery-images', type=int, default=50, help='images fetched from the gallery per fixture')
+    parser.add_argument('--repeat', type=int, default=1, help='uploads per fixture; repeats exercise the result cache')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds to wait for each processing job')
+    parser.add_argument('--workdir', help='scratch directory (default: a new temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    fixtures = [name for name in args.fixtures.split(',') if name]
+    unknown = set(fixtures) - set(FIXTURES)
+    if unknown:
+        parser.error(f"unknown fixtures: {', '.join(sorted(unknown))}")
+
+    # server.py resolves workspaces and caches relative to the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    output_path = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='server-benchmark-'))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import server
+
+    client = server.app.test_client()
+    sampler = WorkerRssSampler()
+    sampler.start()
+    report = {
+        'settings': {
+            'slices': args.slices,
+            'size': args.size,
+            'render_backend': server.RENDER_BACKEND,
+            'render_mode': server.RENDER_MODE,
+            'zip_ingest_mode': server.ZIP_INGEST_MODE,
+            'conversion_workers': server.CONVERSION_WORKERS,
+        },
+        'fixtures': {},
+        'results': [],
+    }
+    try:
+        for name in fixtures:
+            file_name, writer = FIXTURE_WRITERS[name]
+            file_path = os.path.join(workdir, file_name)
+            start = time.perf_counter()
+            writer(file_path, args.slices, args.size)
+            report['fixtures'][name] = {
+                'path': file_path,
+                'size_bytes': os.path.getsize(file_path),
+                'generate_s': time.perf_counter() - start,
+            }
+            for _ in range(args.repeat):
+                report['results'].append(run_fixture(client, name, file_path, args.slices, args.gallery_images,
+                                                     args.timeout, sampler))
+    finally:
+        sampler.stop()
+        server.job_executor.shutdown(wait=True)
+        if server.conversion_pool is not None:
+            server.conversion_pool.shutdown(wait=True)
+        if not args.keep and not args.workdir:
+            os.chdir(tempfile.gettempdir())
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from flask import Flask, request, send_from_directory, jsonify, send_file
+from flask import Flask, request, send_from_directory, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS, cross_origin
 import h5py
 import json
@@ -6,94 +6,798 @@ import numpy as np
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+import hashlib
 import math
+import multiprocessing
 import os
+import queue
 import shutil
+import threading
+import time
+import uuid
 from io import BytesIO
+from collections import OrderedDict, defaultdict, deque
+from contextlib import nullcontext
+from functools import lru_cache
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pydicom
+from pydicom.multival import MultiValue
+from PIL import Image
 import nibabel as nib
 
 app = Flask(__name__,)
 CORS(app)
 
+# Every upload gets its own workspace: workspaces/<upload_id>/{uploads,output,outputView}
+WORKSPACE_FOLDER = 'workspaces'
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
+VIEW_FOLDER = 'outputView'
 METADATA_FOLDER = 'metadata'
+JOB_FILE = 'job.json'
+# Marks a workspace whose upload is still arriving, before it has a job or upload session
+PENDING_FILE = 'pending'
+MANIFEST_FILE = 'manifest.json'
+MAX_MANIFESTS = 256
+# Last-access times are only written to disk this often, not on every request
+WORKSPACE_TOUCH_SECONDS = 60
+# Idle workspaces expire after the TTL; beyond the quota the least recently used are evicted first
+WORKSPACE_TTL_SECONDS = int(os.environ.get('WORKSPACE_TTL_SECONDS', 24 * 60 * 60))
+WORKSPACE_QUOTA_BYTES = int(os.environ.get('WORKSPACE_QUOTA_BYTES', 20 * 1024 ** 3))
+# Processed results are cached by content hash so re-uploads skip the conversion pipelines
+CACHE_FOLDER = 'cache'
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 50 * 1024 ** 3))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Chunked uploads: POST /uploads, PUT byte ranges to /uploads/<id>, then POST /uploads/<id>/finalize
+UPLOAD_SESSION_FILE = 'upload.json'
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 10 * 1024 ** 3))
+MAX_UPLOAD_CHUNK_BYTES = int(os.environ.get('MAX_UPLOAD_CHUNK_BYTES', 64 * 1024 * 1024))
+UPLOAD_SESSION_CHUNK_BYTES = min(MAX_UPLOAD_CHUNK_BYTES, 8 * 1024 * 1024)
+MAX_ACTIVE_UPLOADS = int(os.environ.get('MAX_ACTIVE_UPLOADS', 8))
+MAX_CONCURRENT_CHUNKS = int(os.environ.get('MAX_CONCURRENT_CHUNKS', 16))
+# Unfinished sessions idle for longer no longer count as active and may be evicted
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', 60 * 60))
+ZIP_STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.npy', '.gz', '.zip')
+# 'eager' renders every slice at upload time, 'lazy' only indexes sources and renders via /render on demand
+RENDER_MODE = os.environ.get('RENDER_MODE', 'eager')
+RENDER_INDEX_FILE = 'index.json'
+# Zip members that have to exist as real files are extracted here, under the upload folder
+ARCHIVE_EXTRACT_FOLDER = 'dicomImages'
+# DICOM series are stacked on first use into float32 volumes (rescaled values) kept here
+VOLUME_FOLDER = 'volumes'
+RENDER_FOLDER = 'render'
+RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', 64 * 1024 * 1024))
+# Downscaled copies of every slice image, by longest side; request them with ?size=<level>
+PYRAMID_FOLDER = 'pyramid'
+PYRAMID_LEVELS = {'thumb': 256, 'medium': 1024}
+# Image URLs are scoped to an upload whose files never change, so clients may cache them for long
+IMAGE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+# Slice metadata is consolidated into one JSON-lines file per meta folder
+METADATA_STORE_FILE = 'metadata.jsonl'
+METADATA_PAGE_SIZE = 100
+ARRAY_PAGE_MAX_ITEMS = 100000
+# Also write the legacy indent=4 JSON file per slice next to the store
+METADATA_PER_SLICE_FILES = os.environ.get('METADATA_PER_SLICE_FILES', '0') == '1'
+# Stage/route timers exposed at /metrics; when disabled the timers are shared no-op contexts
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+# Log a structured per-upload stage breakdown when each job finishes (needs METRICS_ENABLED)
+TIMING_LOG_ENABLED = os.environ.get('TIMING_LOG_ENABLED', '0') == '1'
+# Upper bound on the working memory used per slab when exporting HDF5 image datasets
+HDF5_EXPORT_MAX_BYTES = int(os.environ.get('HDF5_EXPORT_MAX_BYTES', 256 * 1024 * 1024))
+# 'stream' decodes zip members straight from the archive while later members decompress;
+# 'extract' unpacks the whole zip to disk first. NIfTI members and lazy mode always need real files.
+ZIP_INGEST_MODE = os.environ.get('ZIP_INGEST_MODE', 'stream')
+# Zip members read ahead of the converters; bounds the decompressed bytes held in memory
+ZIP_PREFETCH_MEMBERS = int(os.environ.get('ZIP_PREFETCH_MEMBERS', 32))
+# Number of processes used to convert DICOM/NIfTI files; 1 keeps conversion in-process.
+# The pool is shared by every job, so this is the total, not a per-upload count.
+CONVERSION_WORKERS = int(os.environ.get('CONVERSION_WORKERS', os.cpu_count() or 1))
+# Uploads with fewer files than this are converted in-process; dispatching them costs more than it saves
+CONVERSION_POOL_MIN_TASKS = int(os.environ.get('CONVERSION_POOL_MIN_TASKS', 16))
+# 'matplotlib' renders slices through pyplot figures, 'direct' encodes the array with Pillow
+RENDER_BACKEND = os.environ.get('RENDER_BACKEND', 'matplotlib')
+JPEG_QUALITY = int(os.environ.get('JPEG_QUALITY', 90))
+# Uploads are processed on background threads; clients poll /jobs/<id> for progress
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+MAX_JOBS = 100
+# Per-item progress is kept in memory and written to job.json at most this often; state changes are written at once
+JOB_PROGRESS_WRITE_SECONDS = float(os.environ.get('JOB_PROGRESS_WRITE_SECONDS', 1.0))
 isHDF5 = False
 isDicom = False
 
-def setup_folders():
-    if os.path.exists(OUTPUT_FOLDER):
-        shutil.rmtree(OUTPUT_FOLDER)
-    if os.path.exists(UPLOAD_FOLDER):
-        shutil.rmtree(UPLOAD_FOLDER)
-    if os.path.exists('outputView'):
-        shutil.rmtree('outputView')
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-    os.makedirs('outputView', exist_ok=True)
+# Whole-file /upload requests are held to the same limit, plus room for the multipart framing
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + UPLOAD_CHUNK_BYTES
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+# Conversion processes are started on first use and reused by later jobs
+conversion_pool = None
+conversion_pool_lock = threading.Lock()
+jobs = {}
+jobs_lock = threading.Lock()
+manifests = OrderedDict()
+manifests_lock = threading.Lock()
+workspace_touched = {}
+render_cache = OrderedDict()
+render_cache_size = 0
+render_cache_lock = threading.Lock()
+# pyplot keeps global figure state, so matplotlib rendering from job and request threads is serialised
+pyplot_lock = threading.Lock()
+metrics_lock = threading.Lock()
+# One lock per series volume being stacked; the global lock only guards the dict
+volume_build_locks = {}
+volume_build_lock = threading.Lock()
+# In-memory state of chunked uploads: the persisted session plus its running hash
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+upload_chunk_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CHUNKS)
+stage_seconds = defaultdict(float)
+stage_calls = defaultdict(int)
+route_seconds = defaultdict(float)
+route_calls = defaultdict(int)
+# Holds the stage breakdown of the upload being processed on the current thread
+timing_context = threading.local()
+
+def workspace_path(upload_id, *parts):
+    return os.path.join(WORKSPACE_FOLDER, upload_id, *parts)
+
+def is_upload_id(value):
+    return isinstance(value, str) and len(value) == 32 and all(c in '0123456789abcdef' for c in value)
+
+def list_workspaces():
+    if not os.path.isdir(WORKSPACE_FOLDER):
+        return []
+    workspaces = []
+    for entry in os.scandir(WORKSPACE_FOLDER):
+        if entry.is_dir() and is_upload_id(entry.name):
+            workspaces.append((entry.stat().st_mtime, entry.name))
+    return sorted(workspaces)
+
+def folder_size(path):
+    total = 0
+    seen = set()
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                stat = os.stat(os.path.join(root, file))
+            except OSError:
+                continue
+            # outputView hardlinks the files under output, so count each inode once
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+def latest_upload_write(upload_id):
+    # The body being streamed by /upload keeps its file's mtime current
+    paths = [workspace_path(upload_id, PENDING_FILE)]
+    if os.path.isdir(workspace_path(upload_id, UPLOAD_FOLDER)):
+        paths += [entry.path for entry in os.scandir(workspace_path(upload_id, UPLOAD_FOLDER))]
+    latest = 0
+    for path in paths:
+        try:
+            latest = max(latest, os.stat(path).st_mtime)
+        except OSError:
+            continue
+    return latest
+
+def workspace_busy(upload_id):
+    if os.path.exists(workspace_path(upload_id, PENDING_FILE)):
+        # A request that died mid-upload leaves its workspace idle, and evictable after the session TTL
+        return time.time() - latest_upload_write(upload_id) < UPLOAD_SESSION_TTL_SECONDS
+    session = read_upload_session(upload_id)
+    if session is not None and session['state'] == 'receiving' and upload_session_live(session):
+        return True
+    job = read_job(upload_id)
+    # A job that never finished within the TTL belonged to a worker that died
+    return (job is not None and job['state'] in ('queued', 'running')
+            and time.time() - job['created_at'] < WORKSPACE_TTL_SECONDS)
+
+def workspace_size(upload_id):
+    job = read_job(upload_id)
+    if job is None or job.get('workspace_bytes') is None:
+        return folder_size(workspace_path(upload_id))
+    # Finished jobs record their size; only what /render and the volume routes wrote since has to be walked
+    return job['workspace_bytes'] + sum(folder_size(workspace_path(upload_id, folder))
+                                        for folder in (RENDER_FOLDER, VOLUME_FOLDER))
+
+def evict_workspaces():
+    workspaces = list_workspaces()
+    sizes = {upload_id: workspace_size(upload_id) for _, upload_id in workspaces}
+    total = sum(sizes.values())
+    now = time.time()
+    for last_access, upload_id in workspaces:
+        if now - last_access <= WORKSPACE_TTL_SECONDS and total <= WORKSPACE_QUOTA_BYTES:
+            break
+        if workspace_busy(upload_id):
+            continue
+        shutil.rmtree(workspace_path(upload_id), ignore_errors=True)
+        forget_manifest(upload_id)
+        total -= sizes[upload_id]
+
+def create_workspace():
+    evict_workspaces()
+    upload_id = uuid.uuid4().hex
+    # Built under a name eviction ignores, so the workspace is never visible without its pending marker
+    staging = workspace_path(upload_id) + '.tmp'
+    for folder in (UPLOAD_FOLDER, OUTPUT_FOLDER, VIEW_FOLDER):
+        os.makedirs(os.path.join(staging, folder), exist_ok=True)
+    open(os.path.join(staging, PENDING_FILE), 'w').close()
+    os.rename(staging, workspace_path(upload_id))
+    return upload_id
+
+def clear_pending(upload_id):
+    # Called once a job or upload session marks the workspace busy instead
+    try:
+        os.remove(workspace_path(upload_id, PENDING_FILE))
+    except FileNotFoundError:
+        pass
+
+def resolve_workspace():
+    # Every output route is scoped to the caller's upload; there is no "latest upload" fallback
+    upload_id = request.args.get('upload_id')
+    if not is_upload_id(upload_id):
+        return None
+    if not os.path.isdir(workspace_path(upload_id)):
+        # Possibly evicted by another server process, which cannot clear this one's manifests
+        forget_manifest(upload_id)
+        return None
+    touch_workspace(upload_id)
+    return upload_id
+
+def touch_workspace(upload_id):
+    now = time.time()
+    if now - workspace_touched.get(upload_id, 0) < WORKSPACE_TOUCH_SECONDS:
+        return
+    workspace_touched[upload_id] = now
+    try:
+        os.utime(workspace_path(upload_id))
+    except OSError:
+        pass
+
+def workspace_not_found():
+    return jsonify({'error': 'Upload not found'}), 404
+
+# Per-upload manifest: input type, view root and a listing of every output directory.
+# Built once when processing finishes so routes never have to probe the filesystem.
+def upload_input_type(file_name):
+    return 'hdf5' if file_name.lower().endswith(('.h5', '.hdf5')) else 'zip'
+
+def upload_view_root(upload_id, file_name):
+    # Zip uploads are browsed through the flattened outputView tree
+    return workspace_path(upload_id, OUTPUT_FOLDER if upload_input_type(file_name) == 'hdf5' else VIEW_FOLDER)
+
+def build_manifest(upload_id, file_name):
+    input_type = upload_input_type(file_name)
+    view_root = upload_view_root(upload_id, file_name)
+    directories = {}
+    for root, dirs, files in os.walk(view_root):
+        directories[os.path.relpath(root, view_root)] = {'dirs': sorted(dirs), 'files': sorted(files)}
+
+    manifest = {
+        'upload_id': upload_id,
+        'input_type': input_type,
+        'view_root': view_root,
+        'directories': directories,
+        'pyramid': os.path.isdir(workspace_path(upload_id, PYRAMID_FOLDER)),
+        'index': load_render_index(upload_id) or {'source_file': None, 'folders': {}, 'volumes': {}},
+    }
+    manifest_path = workspace_path(upload_id, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    remember_manifest(manifest)
+    return manifest
+
+def remember_manifest(manifest):
+    with manifests_lock:
+        manifests[manifest['upload_id']] = manifest
+        manifests.move_to_end(manifest['upload_id'])
+        while len(manifests) > MAX_MANIFESTS:
+            manifests.popitem(last=False)
+
+def forget_manifest(upload_id):
+    with manifests_lock:
+        manifests.pop(upload_id, None)
+
+def get_manifest(upload_id):
+    with manifests_lock:
+        manifest = manifests.get(upload_id)
+        if manifest is not None:
+            manifests.move_to_end(upload_id)
+            return manifest
+    # Built by another server process, or before this one restarted
+    try:
+        with open(workspace_path(upload_id, MANIFEST_FILE), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+    remember_manifest(manifest)
+    return manifest
+
+def resolve_manifest():
+    upload_id = resolve_workspace()
+    return get_manifest(upload_id) if upload_id else None
+
+def manifest_not_found():
+    return jsonify({'error': 'Upload not found or still processing'}), 404
+
+def manifest_directory(manifest, path):
+    return manifest['directories'].get(os.path.normpath(path.strip('/') or '.'))
+
+def requested_level():
+    level = request.args.get('size', 'full')
+    return level if level in PYRAMID_LEVELS else None
+
+def image_cache_response(response):
+    # Image URLs always name their upload, whose outputs never change once written
+    response.cache_control.immutable = True
+    return response
+
+def send_image_file(path):
+    try:
+        response = send_file(os.path.abspath(path), conditional=True, etag=True, max_age=IMAGE_MAX_AGE_SECONDS)
+    except FileNotFoundError:
+        # The workspace was evicted between the manifest lookup and the read
+        return jsonify({'error': 'File not found'}), 404
+    return image_cache_response(response)
+
+def send_image_bytes(data, mimetype='image/jpeg'):
+    return image_cache_response(send_file(BytesIO(data), mimetype=mimetype, conditional=True,
+                                          etag=hashlib.sha1(data).hexdigest(), max_age=IMAGE_MAX_AGE_SECONDS))
+
+def manifest_has_file(manifest, path):
+    listing = manifest_directory(manifest, os.path.dirname(path))
+    return listing is not None and os.path.basename(path) in listing['files']
+
+# Metrics
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.name, time.perf_counter() - self.start)
+
+NULL_TIMER = nullcontext()
+
+def timed_stage(name):
+    return StageTimer(name) if METRICS_ENABLED else NULL_TIMER
+
+def record_stage(name, seconds, calls=1):
+    if not METRICS_ENABLED:
+        return
+    with metrics_lock:
+        stage_seconds[name] += seconds
+        stage_calls[name] += calls
+    timings = getattr(timing_context, 'timings', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def lap(timings, name, start):
+    now = time.perf_counter()
+    timings[name] = timings.get(name, 0.0) + now - start
+    return now
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_metrics():
+    with metrics_lock:
+        stages = [(name, stage_seconds[name], stage_calls[name]) for name in sorted(stage_seconds)]
+        routes = [(key, route_seconds[key], route_calls[key]) for key in sorted(route_seconds)]
+    with jobs_lock:
+        job_states = defaultdict(int)
+        for job in jobs.values():
+            job_states[job['state']] += 1
+
+    lines = [
+        '# HELP upload_stage_seconds_total Time spent in each processing stage.',
+        '# TYPE upload_stage_seconds_total counter',
+    ]
+    lines += [f'upload_stage_seconds_total{{stage="{prometheus_label(name)}"}} {seconds:.6f}' for name, seconds, _ in stages]
+    lines += [
+        '# HELP upload_stage_calls_total Number of times each processing stage ran.',
+        '# TYPE upload_stage_calls_total counter',
+    ]
+    lines += [f'upload_stage_calls_total{{stage="{prometheus_label(name)}"}} {calls}' for name, _, calls in stages]
+    lines += [
+        '# HELP http_request_seconds_total Time spent handling requests.',
+        '# TYPE http_request_seconds_total counter',
+    ]
+    lines += [
+        f'http_request_seconds_total{{endpoint="{prometheus_label(endpoint)}",method="{method}",status="{status}"}} {seconds:.6f}'
+        for (endpoint, method, status), seconds, _ in routes
+    ]
+    lines += [
+        '# HELP http_requests_total Number of requests handled.',
+        '# TYPE http_requests_total counter',
+    ]
+    lines += [
+        f'http_requests_total{{endpoint="{prometheus_label(endpoint)}",method="{method}",status="{status}"}} {calls}'
+        for (endpoint, method, status), _, calls in routes
+    ]
+    lines += [
+        '# HELP upload_jobs Jobs known to this process by state.',
+        '# TYPE upload_jobs gauge',
+    ]
+    lines += [f'upload_jobs{{state="{state}"}} {count}' for state, count in sorted(job_states.items())]
+    return '\n'.join(lines) + '\n'
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            key = (request.endpoint or 'unmatched', request.method, response.status_code)
+            with metrics_lock:
+                route_seconds[key] += time.perf_counter() - start
+                route_calls[key] += 1
+        return response
+
+class ZipStreamBuffer:
+    # Write-only sink for ZipFile; having no tell() makes zipfile emit streamable entries with data descriptors
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(folder_path):
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for root, dirs, files in os.walk(folder_path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                info = zipfile.ZipInfo.from_file(file_path, os.path.relpath(file_path, folder_path))
+                # Images and arrays barely shrink under deflate, so store them as-is
+                info.compress_type = zipfile.ZIP_STORED if file.lower().endswith(ZIP_STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                with open(file_path, 'rb') as source, zf.open(info, 'w') as entry:
+                    while True:
+                        chunk = source.read(UPLOAD_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        data = buffer.pop()
+                        if data:
+                            yield data
+                data = buffer.pop()
+                if data:
+                    yield data
+    yield buffer.pop()
+
+def save_upload(file, file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as output:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            output.write(chunk)
+    return digest.hexdigest()
+
+def cache_key(digest, file_name):
+    # Output depends on how the file is parsed and rendered, not only on its bytes
+    extension = file_name.rsplit('.', 1)[1].lower()
+    return f"{digest}-{extension}-{RENDER_BACKEND}"
+
+def link_file(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def link_tree(source, destination):
+    shutil.copytree(source, destination, copy_function=link_file, dirs_exist_ok=True)
+
+def restore_cached_result(key, upload_id, source_file):
+    entry = os.path.join(CACHE_FOLDER, key)
+    if not os.path.isdir(entry):
+        return False
+    try:
+        os.utime(entry)
+        for folder in (OUTPUT_FOLDER, VIEW_FOLDER, PYRAMID_FOLDER):
+            link_tree(os.path.join(entry, folder), workspace_path(upload_id, folder))
+        if os.path.isfile(os.path.join(entry, RENDER_INDEX_FILE)):
+            with open(os.path.join(entry, RENDER_INDEX_FILE), 'r') as index_file:
+                index = json.load(index_file)
+            # Series volumes read from the upload's own zip, which now lives in this workspace
+            index['source_file'] = source_file
+            with open(workspace_path(upload_id, RENDER_INDEX_FILE), 'w') as index_file:
+                json.dump(index, index_file)
+    except (OSError, json.JSONDecodeError):
+        # The entry was evicted while we were reading it; reprocess instead
+        for folder in (OUTPUT_FOLDER, VIEW_FOLDER, PYRAMID_FOLDER):
+            shutil.rmtree(workspace_path(upload_id, folder), ignore_errors=True)
+            os.makedirs(workspace_path(upload_id, folder), exist_ok=True)
+        return False
+    return True
+
+def store_cached_result(key, upload_id):
+    entry = os.path.join(CACHE_FOLDER, key)
+    if os.path.isdir(entry):
+        return
+    staging = f"{entry}.{upload_id}.tmp"
+    for folder in (OUTPUT_FOLDER, VIEW_FOLDER, PYRAMID_FOLDER):
+        link_tree(workspace_path(upload_id, folder), os.path.join(staging, folder))
+    if os.path.isfile(workspace_path(upload_id, RENDER_INDEX_FILE)):
+        shutil.copy2(workspace_path(upload_id, RENDER_INDEX_FILE), os.path.join(staging, RENDER_INDEX_FILE))
+    try:
+        os.rename(staging, entry)
+    except OSError:
+        # Another worker stored the same content first
+        shutil.rmtree(staging, ignore_errors=True)
+    evict_cache()
+
+def evict_cache():
+    entries = []
+    for entry in os.scandir(CACHE_FOLDER):
+        if entry.is_dir() and not entry.name.endswith('.tmp'):
+            entries.append((entry.stat().st_mtime, entry.path))
+    entries.sort()
+    sizes = {path: folder_size(path) for _, path in entries}
+    total = sum(sizes.values())
+    for _, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= sizes[path]
+
+# Chunked uploads
+def save_upload_session(session):
+    session_path = workspace_path(session['id'], UPLOAD_SESSION_FILE)
+    with open(session_path + '.tmp', 'w') as session_file:
+        json.dump(session, session_file)
+    os.replace(session_path + '.tmp', session_path)
+
+def read_upload_session(upload_id):
+    with upload_sessions_lock:
+        if upload_id in upload_sessions:
+            return dict(upload_sessions[upload_id]['session'])
+    try:
+        with open(workspace_path(upload_id, UPLOAD_SESSION_FILE), 'r') as session_file:
+            return json.load(session_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def upload_session_live(session):
+    return time.time() - session['updated_at'] < UPLOAD_SESSION_TTL_SECONDS
+
+def upload_session_state(upload_id):
+    with upload_sessions_lock:
+        state = upload_sessions.get(upload_id)
+        if state is None:
+            # Sessions survive restarts on disk; only the running hash has to be rebuilt
+            try:
+                with open(workspace_path(upload_id, UPLOAD_SESSION_FILE), 'r') as session_file:
+                    session = json.load(session_file)
+            except (OSError, json.JSONDecodeError):
+                return None
+            state = upload_sessions[upload_id] = {
+                'session': session, 'lock': threading.Lock(), 'digest': hashlib.sha256(), 'hashed': 0,
+            }
+        if not os.path.isfile(state['session']['file_path']):
+            # The workspace was evicted after the session went idle
+            del upload_sessions[upload_id]
+            return None
+        return state
+
+def active_upload_count():
+    with upload_sessions_lock:
+        return sum(1 for state in upload_sessions.values()
+                   if state['session']['state'] == 'receiving' and upload_session_live(state['session']))
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def missing_ranges(session):
+    missing, position = [], 0
+    for start, end in session['ranges']:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < session['file_size']:
+        missing.append([position, session['file_size']])
+    return missing
+
+def upload_session_status(session):
+    return {
+        'upload_id': session['id'],
+        'state': session['state'],
+        'file_name': session['file_name'],
+        'file_size': session['file_size'],
+        'chunk_size': UPLOAD_SESSION_CHUNK_BYTES,
+        'bytes_received': sum(end - start for start, end in session['ranges']),
+        'received': session['ranges'],
+        'missing': missing_ranges(session),
+    }
+
+def preallocate(fd, size):
+    if size and hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, size)
+    else:
+        os.ftruncate(fd, size)
+
+def write_at(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+def parse_content_range(header, file_size):
+    # "bytes <first>-<last>/<total>", last inclusive as in HTTP
+    try:
+        unit, _, byte_range = header.partition(' ')
+        span, _, total = byte_range.partition('/')
+        first, _, last = span.partition('-')
+        first, last = int(first), int(last)
+    except (AttributeError, ValueError):
+        return None
+    if unit != 'bytes' or total not in ('*', str(file_size)) or not 0 <= first <= last < file_size:
+        return None
+    return first, last + 1
+
+def catch_up_hash(state):
+    # Hashes the contiguous prefix received so far; the caller holds state['lock']
+    session = state['session']
+    ranges = session['ranges']
+    end = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    if state['hashed'] >= end:
+        return
+    with open(session['file_path'], 'rb') as upload_file:
+        upload_file.seek(state['hashed'])
+        while state['hashed'] < end:
+            chunk = upload_file.read(min(UPLOAD_CHUNK_BYTES, end - state['hashed']))
+            if not chunk:
+                break
+            state['digest'].update(chunk)
+            state['hashed'] += len(chunk)
+
+def receive_chunk(state, start, end):
+    session = state['session']
+    # In-order chunks are hashed while they are written; anything else is caught up from disk later
+    hashing = state['lock'].acquire(blocking=False)
+    if hashing and state['hashed'] != start:
+        state['lock'].release()
+        hashing = False
+
+    position = start
+    fd = os.open(session['file_path'], os.O_WRONLY)
+    try:
+        while position < end:
+            chunk = request.stream.read(min(UPLOAD_CHUNK_BYTES, end - position))
+            if not chunk:
+                break
+            write_at(fd, chunk, position)
+            if hashing:
+                state['digest'].update(chunk)
+                state['hashed'] += len(chunk)
+            position += len(chunk)
+    finally:
+        os.close(fd)
+        if hashing:
+            state['lock'].release()
+
+    with state['lock']:
+        if position > start:
+            session['ranges'] = merge_ranges(session['ranges'] + [[start, position]])
+        session['updated_at'] = time.time()
+        save_upload_session(session)
+        catch_up_hash(state)
+    return position
+
+def start_processing(upload_id, file_name, file_path, digest):
+    key = cache_key(digest, file_name)
+    timing_context.timings = timings = {}
+    try:
+        job = create_job(upload_id, file_name, os.path.getsize(file_path))
+        with timed_stage('cache_restore'):
+            cached = restore_cached_result(key, upload_id, file_path)
+        if cached:
+            with timed_stage('manifest_build'):
+                build_manifest(upload_id, file_name)
+    finally:
+        timing_context.timings = None
+
+    if cached:
+        now = time.time()
+        update_job(upload_id, state='done', cached=True, started_at=now, finished_at=now,
+                   timings=timings if METRICS_ENABLED else None, workspace_bytes=folder_size(workspace_path(upload_id)))
+    else:
+        job_executor.submit(run_upload_job, upload_id, file_path, key, timings)
+
+    return jsonify({
+        'message': 'File already processed, results restored from cache' if cached else 'File successfully uploaded, processing started',
+        'upload_id': upload_id,
+        'sha256': digest,
+        'cached': cached,
+        'job_id': job['id'],
+        'status_url': f"/jobs/{job['id']}",
+        'file_name': file_name,
+        'file_size': job['file_size'],
+        'file_path': file_path
+    }), 202
 
 
 # Upload/output Routes
 @app.route('/output-files', methods=['GET'])
 @cross_origin()
 def list_output_files():
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+
     path = request.args.get('path', '')
-    VISUALIZATION_FOLDER = 'output'
-    uploads_folder = 'uploads'
-    if os.path.isdir(uploads_folder) and os.listdir(uploads_folder):
-        first_file = os.path.join(uploads_folder, os.listdir(uploads_folder)[0])
-        if os.path.isfile(first_file) and zipfile.is_zipfile(first_file):
-            VISUALIZATION_FOLDER = 'outputView'
-    directory = os.path.join(VISUALIZATION_FOLDER, path)
-    if not os.path.exists(directory):
+    listing = manifest_directory(manifest, path)
+    if listing is None:
         return jsonify({'error': 'Directory not found'}), 404
 
-    files = os.listdir(directory)
+    files = listing['dirs'] + listing['files']
     return jsonify(files)
 
 @app.route('/output-files/<path:filename>', methods=['GET'])
 @cross_origin()
 def get_output_file(filename):
-    VISUALIZATION_FOLDER = 'output'
-    uploads_folder = 'uploads'
-    if os.path.isdir(uploads_folder) and os.listdir(uploads_folder):
-        first_file = os.path.join(uploads_folder, os.listdir(uploads_folder)[0])
-        folder_path = os.path.join(VISUALIZATION_FOLDER, filename)
-        if os.path.isfile(first_file) and zipfile.is_zipfile(first_file):
-            VISUALIZATION_FOLDER = 'outputView'
-            folder_path = os.path.join(VISUALIZATION_FOLDER, filename)
-            return send_file(folder_path)
-    print("output file path: " + folder_path)
-    return send_file(folder_path)
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+
+    if not manifest_has_file(manifest, filename):
+        return jsonify({'error': 'File not found'}), 404
+    try:
+        return send_file(os.path.abspath(os.path.join(manifest['view_root'], filename)))
+    except FileNotFoundError:
+        return jsonify({'error': 'File not found'}), 404
 
 @app.route('/output-files/download-folder', methods=['GET'])
 @cross_origin()
 def download_folder():
-    folder_path = request.args.get('folder')
-    if not folder_path:
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+
+    folder = request.args.get('folder')
+    if not folder:
         return jsonify({'error': 'Folder parameter is required'}), 400
 
-    folder_path = os.path.join(OUTPUT_FOLDER, folder_path)
-    if not os.path.isdir(folder_path):
+    # Only folders listed in the manifest are served, so the name can never leave the upload's view root
+    if manifest_directory(manifest, folder) is None:
         return jsonify({'error': 'Folder not found'}), 404
+    folder_path = os.path.normpath(os.path.join(manifest['view_root'], folder.strip('/')))
 
-    memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zf.write(file_path, os.path.relpath(file_path, folder_path))
-
-    memory_file.seek(0)
-    return send_file(memory_file, mimetype='application/zip', as_attachment=True, download_name=f'{os.path.basename(folder_path)}.zip')
+    return Response(stream_with_context(stream_zip(folder_path)), mimetype='application/zip', direct_passthrough=True, headers={
+        'Content-Disposition': f'attachment; filename="{os.path.basename(folder_path)}.zip"',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/upload', methods=['POST'])
 @cross_origin()
 def upload_file():
-    setup_folders()
-
     if 'file' not in request.files or len(request.files) != 1:
         return jsonify({'error': 'Please upload exactly one file'}), 400
 
@@ -102,51 +806,174 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
 
     if allowed_file(file.filename):
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(file_path)
-
-        if file.filename.lower().endswith(('.h5', '.hdf5')):
-            mainHDF5Method(file_path)
-        else:
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall('uploads/dicomImages')
-            
-            mainDICOMMethod('uploads/dicomImages', OUTPUT_FOLDER)
-
-        return jsonify({
-            'message': 'File successfully uploaded and processed',
-            'file_name': file.filename,
-            'file_size': os.path.getsize(file_path),
-            'file_path': file_path
-        }), 200
+        with timed_stage('workspace_create'):
+            upload_id = create_workspace()
+        file_path = workspace_path(upload_id, UPLOAD_FOLDER, file.filename)
+        with timed_stage('file_save'):
+            digest = save_upload(file, file_path)
+        return start_processing(upload_id, file.filename, file_path, digest)
     else:
         return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/uploads', methods=['POST'])
+@cross_origin()
+def create_upload_session():
+    body = request.get_json(silent=True) or {}
+    file_name = os.path.basename(str(body.get('file_name', '')))
+    file_size = body.get('file_size')
+    if not allowed_file(file_name):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if not isinstance(file_size, int) or file_size < 0:
+        return jsonify({'error': 'file_size must be a non-negative integer'}), 400
+    if file_size > MAX_UPLOAD_BYTES:
+        return jsonify({'error': f'File exceeds the {MAX_UPLOAD_BYTES} byte upload limit'}), 413
+    if active_upload_count() >= MAX_ACTIVE_UPLOADS:
+        return jsonify({'error': 'Too many uploads in progress, retry later'}), 429, {'Retry-After': '30'}
+
+    upload_id = create_workspace()
+    file_path = workspace_path(upload_id, UPLOAD_FOLDER, file_name)
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        preallocate(fd, file_size)
+    except OSError:
+        os.close(fd)
+        shutil.rmtree(workspace_path(upload_id), ignore_errors=True)
+        return jsonify({'error': 'Not enough disk space for this upload'}), 507
+    os.close(fd)
+
+    now = time.time()
+    session = {
+        'id': upload_id,
+        'state': 'receiving',
+        'file_name': file_name,
+        'file_size': file_size,
+        'file_path': file_path,
+        'ranges': [],
+        'created_at': now,
+        'updated_at': now,
+    }
+    save_upload_session(session)
+    clear_pending(upload_id)
+    with upload_sessions_lock:
+        upload_sessions[upload_id] = {'session': session, 'lock': threading.Lock(), 'digest': hashlib.sha256(), 'hashed': 0}
+    return jsonify(upload_session_status(session)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@cross_origin()
+def get_upload_session(upload_id):
+    session = read_upload_session(upload_id) if is_upload_id(upload_id) else None
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload_session_status(session))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@cross_origin()
+def put_upload_chunk(upload_id):
+    state = upload_session_state(upload_id) if is_upload_id(upload_id) else None
+    if state is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    session = state['session']
+    if session['state'] != 'receiving':
+        return jsonify({'error': 'Upload already finalized'}), 409
+
+    byte_range = parse_content_range(request.headers.get('Content-Range'), session['file_size'])
+    if byte_range is None:
+        return jsonify({'error': 'A valid Content-Range header is required'}), 416
+    start, end = byte_range
+    if end - start > MAX_UPLOAD_CHUNK_BYTES:
+        return jsonify({'error': f'Chunks are limited to {MAX_UPLOAD_CHUNK_BYTES} bytes'}), 413
+    if request.content_length is not None and request.content_length != end - start:
+        return jsonify({'error': 'Content-Length does not match Content-Range'}), 400
+
+    if not upload_chunk_slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many chunks in flight, retry later'}), 429, {'Retry-After': '1'}
+    try:
+        with timed_stage('chunk_write'):
+            received = receive_chunk(state, start, end)
+    finally:
+        upload_chunk_slots.release()
+
+    status = upload_session_status(session)
+    if received < end:
+        status['error'] = 'Chunk was truncated, resend the missing range'
+        return jsonify(status), 400
+    return jsonify(status)
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@cross_origin()
+def finalize_upload(upload_id):
+    state = upload_session_state(upload_id) if is_upload_id(upload_id) else None
+    if state is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    with state['lock']:
+        session = state['session']
+        if session['state'] != 'receiving':
+            return jsonify({'error': 'Upload already finalized'}), 409
+        missing = missing_ranges(session)
+        if missing:
+            return jsonify({'error': 'Upload incomplete', 'missing': missing}), 409
+
+        with timed_stage('upload_hash'):
+            catch_up_hash(state)
+        digest = state['digest'].hexdigest()
+        expected = (request.get_json(silent=True) or {}).get('sha256')
+        if expected and expected.lower() != digest:
+            return jsonify({'error': 'Checksum mismatch', 'sha256': digest}), 400
+
+        session['state'] = 'finalized'
+        session['updated_at'] = time.time()
+        save_upload_session(session)
+
+    with upload_sessions_lock:
+        upload_sessions.pop(upload_id, None)
+    return start_processing(upload_id, session['file_name'], session['file_path'], digest)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs', methods=['GET'])
+@cross_origin()
+def list_jobs():
+    workspace_jobs = [read_job(upload_id) for _, upload_id in list_workspaces()]
+    return jsonify([job_status(job) for job in workspace_jobs if job is not None])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def get_job(job_id):
+    job = read_job(job_id) if is_upload_id(job_id) else None
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
 @app.route('/output-files/folder-images', methods=['GET'])
 @cross_origin()
 def get_folder_images():
-    VISUALIZATION_FOLDER = 'output'
-    uploads_folder = 'uploads'
-
-    if os.path.isdir(uploads_folder) and os.listdir(uploads_folder):
-        first_file = os.path.join(uploads_folder, os.listdir(uploads_folder)[0])
-        if os.path.isfile(first_file) and zipfile.is_zipfile(first_file):
-            VISUALIZATION_FOLDER = 'outputView'
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+    upload_id = manifest['upload_id']
 
     folder_path = request.args.get('folder')
     if not folder_path:
         app.logger.error("Folder parameter is required")
         return jsonify({'error': 'Folder parameter is required'}), 400
 
-    full_folder_path = os.path.join(VISUALIZATION_FOLDER, folder_path)
-    app.logger.debug(f"Looking for images in: {full_folder_path}")
+    render_index = manifest['index']
+    if folder_path in render_index['folders']:
+        count = render_index['folders'][folder_path]['count']
+        return jsonify([f"http://127.0.0.1:5000/render/{folder_path}/{i}?upload_id={upload_id}&size=thumb" for i in range(count)])
 
-    if not os.path.isdir(full_folder_path):
-        app.logger.error(f"Folder not found: {full_folder_path}")
+    listing = manifest_directory(manifest, folder_path)
+    app.logger.debug(f"Looking for images in: {folder_path}")
+
+    if listing is None:
+        app.logger.error(f"Folder not found: {folder_path}")
         return jsonify({'error': 'Folder not found'}), 404
 
-    image_files = [file for file in os.listdir(full_folder_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
-    image_urls = [f"http://127.0.0.1:5000/output/{folder_path}/{file}" for file in image_files]
+    image_files = [file for file in listing['files'] if file.endswith(('.jpg', '.jpeg', '.png'))]
+    image_urls = [f"http://127.0.0.1:5000/output/{folder_path}/{file}?upload_id={upload_id}&size=thumb" for file in image_files]
     app.logger.debug(f"Image URLs: {image_urls}")
 
     return jsonify(image_urls)
@@ -154,36 +981,192 @@ def get_folder_images():
 @app.route('/output/<path:folder>/<path:image>', methods=['GET'])
 @cross_origin()
 def get_image_file(folder, image):
-    VISUALIZATION_FOLDER = 'output'
-    uploads_folder = 'uploads'
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
 
-    if os.path.isdir(uploads_folder) and os.listdir(uploads_folder):
-        first_file = os.path.join(uploads_folder, os.listdir(uploads_folder)[0])
-        if os.path.isfile(first_file) and zipfile.is_zipfile(first_file):
-            VISUALIZATION_FOLDER = 'outputView'
-
-    folder_path = os.path.join(VISUALIZATION_FOLDER, folder, image)
+    folder_path = os.path.join(manifest['view_root'], folder, image)
     app.logger.debug(f"Serving image from path: {folder_path}")
 
-    if not os.path.isfile(folder_path):
+    if not manifest_has_file(manifest, os.path.join(folder, image)):
         app.logger.error(f"Image file not found: {folder_path}")
         return jsonify({'error': 'Image file not found'}), 404
 
-    return send_file(folder_path)
+    level = requested_level()
+    if level and manifest.get('pyramid'):
+        folder_path = workspace_path(manifest['upload_id'], PYRAMID_FOLDER, level, folder, image)
+    return send_image_file(folder_path)
+
+@app.route('/render/<path:folder>/<int:index>', methods=['GET'])
+@cross_origin()
+def render_slice(folder, index):
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+    upload_id = manifest['upload_id']
+
+    render_index = manifest['index']
+    entry = render_index['folders'].get(folder)
+    if entry is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    if not 0 <= index < entry['count']:
+        return jsonify({'error': 'Slice index out of range'}), 404
+
+    source_file = render_index['source_file']
+    data = render_level(upload_id, os.path.join(folder, f"img{index}.jpg"),
+                        lambda output_path: render_source_image(source_file, entry, index, output_path), requested_level())
+    return send_image_bytes(data)
+
+@app.route('/volumes', methods=['GET'])
+@cross_origin()
+def list_volumes():
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+
+    volumes = manifest['index']['volumes']
+    return jsonify({name: {key: value for key, value in entry.items() if key not in ('file', 'member', 'slices')}
+                    for name, entry in volumes.items()})
+
+@app.route('/volumes/<path:name>/<axis>/<int:index>', methods=['GET'])
+@cross_origin()
+def render_volume_slice(name, axis, index):
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+    upload_id = manifest['upload_id']
+
+    entry = manifest['index']['volumes'].get(name)
+    if entry is None:
+        return jsonify({'error': 'Volume not found'}), 404
+    if axis not in NIFTI_AXES:
+        return jsonify({'error': f"Axis must be one of {', '.join(NIFTI_AXES)}"}), 400
+
+    volume = request.args.get('volume', 0, type=int)
+    if not 0 <= index < entry['axes'][axis] or not 0 <= volume < entry['volumes']:
+        return jsonify({'error': 'Slice index out of range'}), 404
+
+    display, suffix = volume_display(entry)
+    # The source is only opened (and a series only stacked) when the render cache misses
+    data = render_level(upload_id, os.path.join('volumes', name, axis, str(volume), f"img{index}{suffix}.jpg"),
+                        lambda output_path: convert_to_jpg(
+                            volume_plane(entry, volume_source(manifest, name, entry, volume), axis, index=index),
+                            output_path, display),
+                        requested_level())
+    return send_image_bytes(data)
+
+@app.route('/volumes/<path:name>/<axis>/mip', methods=['GET'])
+@cross_origin()
+def render_volume_projection(name, axis):
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+    upload_id = manifest['upload_id']
+
+    entry = manifest['index']['volumes'].get(name)
+    if entry is None:
+        return jsonify({'error': 'Volume not found'}), 404
+    if axis not in NIFTI_AXES:
+        return jsonify({'error': f"Axis must be one of {', '.join(NIFTI_AXES)}"}), 400
+
+    # Projects the slab [start, end) along the axis; the whole volume by default
+    volume = request.args.get('volume', 0, type=int)
+    start = request.args.get('start', 0, type=int)
+    end = request.args.get('end', entry['axes'][axis], type=int)
+    if not 0 <= start < end <= entry['axes'][axis] or not 0 <= volume < entry['volumes']:
+        return jsonify({'error': 'Slab out of range'}), 404
+
+    display, suffix = volume_display(entry)
+    data = render_level(upload_id, os.path.join('volumes', name, axis, str(volume), f"mip{start}-{end}{suffix}.jpg"),
+                        lambda output_path: convert_to_jpg(
+                            volume_plane(entry, volume_source(manifest, name, entry, volume), axis, start=start, end=end),
+                            output_path, display),
+                        requested_level())
+    return send_image_bytes(data)
+
+@app.route('/output-files/folder-metadata', methods=['GET'])
+@cross_origin()
+def get_folder_metadata():
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+
+    folder_path = request.args.get('folder')
+    if not folder_path:
+        return jsonify({'error': 'Folder parameter is required'}), 400
+
+    if not manifest_has_file(manifest, os.path.join(folder_path, METADATA_STORE_FILE)):
+        return jsonify({'error': 'No metadata found for folder'}), 404
+
+    offset, limit, fields, filters = metadata_query_args()
+    total, records = query_metadata_store(os.path.join(manifest['view_root'], folder_path, METADATA_STORE_FILE),
+                                          offset, limit, fields, filters)
+    return jsonify({
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'items': records
+    })
+
+@app.route('/output-files/array', methods=['GET'])
+@cross_origin()
+def get_array_range():
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+
+    file_name = request.args.get('file')
+    if not file_name or not file_name.endswith('.npy'):
+        return jsonify({'error': 'File parameter must name a .npy file'}), 400
+    if not manifest_has_file(manifest, file_name):
+        return jsonify({'error': 'File not found'}), 404
+
+    # Memory-mapped, so only the requested rows/columns are read from disk
+    try:
+        array = np.load(os.path.join(manifest['view_root'], file_name), mmap_mode='r', allow_pickle=False)
+    except ValueError:
+        # Object arrays (variable-length HDF5 data other than strings) are stored pickled
+        return jsonify({'error': 'Array has no fixed-size layout and cannot be paged; download the file instead'}), 400
+    row_start = max(0, request.args.get('row_start', 0, type=int))
+    row_stop = min(array.shape[0], request.args.get('row_stop', row_start + 100, type=int))
+    page = array[row_start:row_stop]
+    col_start = col_stop = None
+    if array.ndim >= 2:
+        col_start = max(0, request.args.get('col_start', 0, type=int))
+        col_stop = min(array.shape[1], request.args.get('col_stop', array.shape[1], type=int))
+        page = page[:, col_start:col_stop]
+
+    if page.size > ARRAY_PAGE_MAX_ITEMS:
+        return jsonify({'error': f'Requested range exceeds {ARRAY_PAGE_MAX_ITEMS} values'}), 400
+
+    page = np.array(page)
+    if page.dtype.kind == 'S':
+        page = np.char.decode(page, errors='replace')
+    elif page.dtype.kind == 'c':
+        page = page.astype(str)
+    elif page.dtype.kind == 'f' and not np.isfinite(page).all():
+        # NaN/inf are not valid JSON
+        page = np.where(np.isfinite(page), page, None)
+
+    return jsonify({
+        'shape': list(array.shape),
+        'dtype': str(array.dtype),
+        'row_start': row_start,
+        'row_stop': max(row_start, row_stop),
+        'col_start': col_start,
+        'col_stop': col_stop,
+        'values': page.tolist()
+    })
 
 # New route to view folder contents as JSONs
 @app.route('/output-files/folder-metadata-text', methods=['GET'])
 @cross_origin()
 def get_folder_metadata_text():
-    VISUALIZATION_FOLDER = 'output'
-    uploads_folder = 'uploads'
-    
-    # Check if the upload folder contains a zip file
-    if os.path.isdir(uploads_folder) and os.listdir(uploads_folder):
-        first_file = os.path.join(uploads_folder, os.listdir(uploads_folder)[0])
-        if os.path.isfile(first_file) and zipfile.is_zipfile(first_file):
-            VISUALIZATION_FOLDER = 'outputView'
-    
+    manifest = resolve_manifest()
+    if manifest is None:
+        return manifest_not_found()
+    VISUALIZATION_FOLDER = manifest['view_root']
+
     # Get the folder path from the request
     folder_path = request.args.get('folder')
     if not folder_path:
@@ -195,26 +1178,22 @@ def get_folder_metadata_text():
     app.logger.debug(f"Looking for metadata and text files in: {full_folder_path}")
 
     # Check if the folder exists
-    if not os.path.isdir(full_folder_path):
+    listing = manifest_directory(manifest, folder_path)
+    if listing is None:
         app.logger.error(f"Folder not found: {full_folder_path}")
         return jsonify({'error': 'Folder not found'}), 404
 
-    # Find metadata and text files
-    metadata_files = [file for file in os.listdir(full_folder_path) if file.endswith('.json')]
-    text_files = [file for file in os.listdir(full_folder_path) if file.endswith('.txt')]
-
-    # Read the contents of the metadata files
+    # Read one page of slice metadata from the consolidated store, keyed by the slice's JSON name
+    offset, limit, fields, filters = metadata_query_args()
     metadata_contents = {}
-    for metadata_file in metadata_files:
-        file_path = os.path.join(full_folder_path, metadata_file)
-        with open(file_path, 'r') as file:
-            try:
-                metadata_contents[metadata_file] = json.load(file)
-            except json.JSONDecodeError as e:
-                app.logger.error(f"Error decoding JSON from file {file_path}: {e}")
-                metadata_contents[metadata_file] = {"error": "Invalid JSON file"}
+    total = 0
+    if METADATA_STORE_FILE in listing['files']:
+        total, records = query_metadata_store(os.path.join(full_folder_path, METADATA_STORE_FILE),
+                                              offset, limit, fields, filters)
+        metadata_contents = {record.get('file', str(offset + i)): record for i, record in enumerate(records)}
 
     # Read the contents of the text files
+    text_files = [file for file in listing['files'] if file.endswith('.txt')]
     text_contents = {}
     for text_file in text_files:
         file_path = os.path.join(full_folder_path, text_file)
@@ -224,9 +1203,342 @@ def get_folder_metadata_text():
     # Return the combined contents as a JSON response
     return jsonify({
         'metadata': metadata_contents,
-        'text': text_contents
+        'text': text_contents,
+        'total': total,
+        'offset': offset,
+        'limit': limit
     })
 
+# Background processing jobs
+def save_job(job):
+    # Persisted next to the results so any server process can answer /jobs/<id>
+    job_path = workspace_path(job['id'], JOB_FILE)
+    with open(job_path + '.tmp', 'w') as job_file:
+        json.dump(job, job_file)
+    os.replace(job_path + '.tmp', job_path)
+
+def read_job(job_id):
+    with jobs_lock:
+        if job_id in jobs:
+            return dict(jobs[job_id])
+    try:
+        with open(workspace_path(job_id, JOB_FILE), 'r') as job_file:
+            return json.load(job_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def create_job(upload_id, file_name, file_size):
+    job = {
+        'id': upload_id,
+        'state': 'queued',
+        'file_name': file_name,
+        'file_size': file_size,
+        'unit': 'datasets' if file_name.lower().endswith(('.h5', '.hdf5')) else 'slices',
+        'processed': 0,
+        'total': 0,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'error': None,
+        'cached': False,
+        'timings': None,
+        'workspace_bytes': None,
+    }
+    with jobs_lock:
+        jobs[job['id']] = job
+        save_job(job)
+        clear_pending(upload_id)
+        finished = [job_id for job_id, old in jobs.items() if old['state'] in ('done', 'failed')]
+        for job_id in finished[:max(0, len(jobs) - MAX_JOBS)]:
+            del jobs[job_id]
+    return job
+
+def update_job(job_id, persist=True, **fields):
+    with jobs_lock:
+        jobs[job_id].update(fields)
+        job = dict(jobs[job_id])
+    # Written outside the lock so /jobs reads never wait on the disk; only the job's own thread updates it
+    if persist:
+        save_job(job)
+
+def job_status(job):
+    status = dict(job)
+    status['percent'] = round(100.0 * job['processed'] / job['total'], 1) if job['total'] else 0.0
+    if job['state'] == 'done':
+        status['percent'] = 100.0
+
+    elapsed = None
+    if job['started_at']:
+        elapsed = (job['finished_at'] or time.time()) - job['started_at']
+    status['elapsed_seconds'] = elapsed
+    status['items_per_second'] = job['processed'] / elapsed if elapsed else None
+    status['bytes_per_second'] = job['file_size'] / elapsed if elapsed and job['state'] == 'done' else None
+    return status
+
+def run_upload_job(job_id, file_path, key=None, timings=None):
+    update_job(job_id, state='running', started_at=time.time())
+    timing_context.timings = timings = timings if timings is not None else {}
+
+    last_write = time.monotonic()
+
+    def progress(processed, total):
+        nonlocal last_write
+        now = time.monotonic()
+        persist = processed == total or now - last_write >= JOB_PROGRESS_WRITE_SECONDS
+        if persist:
+            last_write = now
+        update_job(job_id, persist=persist, processed=processed, total=total)
+
+    try:
+        cacheable = process_upload(job_id, file_path, progress)
+    except Exception as e:
+        app.logger.exception(f"Processing failed for {file_path}")
+        # Partial output stays browsable
+        with timed_stage('manifest_build'):
+            build_manifest(job_id, file_path)
+        state, error = 'failed', str(e)
+    else:
+        with timed_stage('manifest_build'):
+            build_manifest(job_id, file_path)
+        state, error = 'done', None
+    finally:
+        timing_context.timings = None
+
+    update_job(job_id, state=state, error=error, finished_at=time.time(), timings=timings if METRICS_ENABLED else None,
+               workspace_bytes=folder_size(workspace_path(job_id)))
+    if METRICS_ENABLED and TIMING_LOG_ENABLED:
+        app.logger.info(json.dumps({'event': 'upload_timings', 'upload_id': job_id, 'state': state,
+                                    'stages': {name: round(seconds, 6) for name, seconds in timings.items()}}))
+
+    if state == 'done' and key and cacheable:
+        try:
+            with timed_stage('cache_store'):
+                store_cached_result(key, job_id)
+        except OSError:
+            app.logger.exception(f"Could not cache results for {file_path}")
+
+def process_upload(upload_id, file_path, progress=None):
+    output_folder = workspace_path(upload_id, OUTPUT_FOLDER)
+    render_index = {'source_file': file_path, 'folders': {}} if RENDER_MODE == 'lazy' else None
+    volume_index = {}
+    if file_path.lower().endswith(('.h5', '.hdf5')):
+        mainHDF5Method(file_path, output_folder, progress, render_index)
+    else:
+        input_folder = workspace_path(upload_id, UPLOAD_FOLDER, ARCHIVE_EXTRACT_FOLDER)
+        view_folder = workspace_path(upload_id, VIEW_FOLDER)
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            if ZIP_INGEST_MODE == 'stream':
+                mainDICOMMethod(input_folder, output_folder, view_folder, progress, render_index, volume_index, zip_ref)
+            else:
+                with timed_stage('zip_extract'):
+                    zip_ref.extractall(input_folder)
+                mainDICOMMethod(input_folder, output_folder, view_folder, progress, render_index, volume_index)
+
+    with timed_stage('pyramid_build'):
+        build_pyramid(upload_id, upload_view_root(upload_id, file_path))
+
+    index = {'source_file': file_path, 'folders': render_index['folders'] if render_index else {}, 'volumes': volume_index}
+    with open(workspace_path(upload_id, RENDER_INDEX_FILE), 'w') as index_file:
+        json.dump(index, index_file)
+    # Indexed entries point at this workspace's own source files, which the result cache does not keep.
+    # Series read from the uploaded zip by member name are the exception: any copy of the zip will do.
+    return not index['folders'] and all(entry.get('archive') for entry in index['volumes'].values())
+
+# On-demand rendering
+def load_render_index(upload_id):
+    try:
+        with open(workspace_path(upload_id, RENDER_INDEX_FILE), 'r') as index_file:
+            return json.load(index_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+@lru_cache(maxsize=64)
+def dataset_scale_down(file_path, dataset_name):
+    with h5py.File(file_path, 'r') as file:
+        dataset = file[dataset_name]
+        return bool(max(np.max(np.abs(slab)) for _, slab in iter_dataset_slabs(dataset)) > 1)
+
+def render_source_image(source_file, entry, index, output_path):
+    if entry['source'] == 'hdf5':
+        with h5py.File(source_file, 'r') as file:
+            dataset = file[entry['dataset']]
+            image = np.abs(dataset[index])
+            ndim = dataset.ndim
+        # Single-channel images are normalised per image, so only RGB data needs the global scale
+        if image.ndim == 3 and image.shape[-1] in (3, 4) and dataset_scale_down(source_file, entry['dataset']):
+            image = image / 255.0
+        if ndim == 2:
+            image = image.reshape(int(math.sqrt(image.shape[0])), int(math.sqrt(image.shape[0])))
+        save_dataset_image(image, output_path)
+        return
+
+    item = entry['items'][index]
+    if item['kind'] == 'dicom':
+        ds = pydicom.dcmread(item['file'])
+        convert_to_jpg(ds.pixel_array, output_path, dicom_display_window(ds))
+    else:
+        convert_to_jpg(nifti_slice(nib.load(item['file'])), output_path)
+
+def render_cached(upload_id, relative_path, render):
+    global render_cache_size
+    key = (upload_id, relative_path)
+    with render_cache_lock:
+        if key in render_cache:
+            render_cache.move_to_end(key)
+            return render_cache[key]
+
+    output_path = workspace_path(upload_id, RENDER_FOLDER, relative_path)
+    if not os.path.isfile(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        root, extension = os.path.splitext(output_path)
+        temp_path = f"{root}.{uuid.uuid4().hex}.tmp{extension}"
+        with timed_stage('on_demand_render'):
+            render(temp_path)
+        os.replace(temp_path, output_path)
+
+    with open(output_path, 'rb') as image_file:
+        data = image_file.read()
+
+    with render_cache_lock:
+        if key not in render_cache:
+            render_cache[key] = data
+            render_cache_size += len(data)
+        while render_cache_size > RENDER_CACHE_BYTES and len(render_cache) > 1:
+            _, evicted = render_cache.popitem(last=False)
+            render_cache_size -= len(evicted)
+    return data
+
+def render_level(upload_id, relative_path, render, level=None):
+    data = render_cached(upload_id, relative_path, render)
+    if level is None:
+        return data
+    return render_cached(upload_id, os.path.join(PYRAMID_FOLDER, level, relative_path),
+                         lambda output_path: write_pyramid(BytesIO(data), [(output_path, PYRAMID_LEVELS[level])]))
+
+# Volumes: NIfTI files and DICOM series, resliced and projected on demand
+def series_volume_path(upload_id, name):
+    return workspace_path(upload_id, VOLUME_FOLDER, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.npy')
+
+def build_series_volume(entry, source_file, volume_path):
+    os.makedirs(os.path.dirname(volume_path), exist_ok=True)
+    temp_path = f"{volume_path[:-len('.npy')]}.{uuid.uuid4().hex}.tmp.npy"
+    volume = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=tuple(entry['shape']))
+    archive = zipfile.ZipFile(source_file, 'r') if entry['archive'] else None
+    try:
+        # Slices are decoded straight into the contiguous stack, in position order
+        for index, item in enumerate(entry['slices']):
+            source = BytesIO(archive.read(item['source'])) if archive else item['source']
+            volume[index] = pydicom.dcmread(source).pixel_array
+    finally:
+        if archive:
+            archive.close()
+
+    # Modality LUT for the whole stack at once; slope and intercept may differ per slice
+    volume *= np.array([item['slope'] for item in entry['slices']], dtype=np.float32)[:, None, None]
+    volume += np.array([item['intercept'] for item in entry['slices']], dtype=np.float32)[:, None, None]
+    volume.flush()
+    del volume
+    os.replace(temp_path, volume_path)
+
+def load_series_volume(manifest, name, entry):
+    volume_path = series_volume_path(manifest['upload_id'], name)
+    if not os.path.isfile(volume_path):
+        with volume_build_lock:
+            lock = volume_build_locks.setdefault(volume_path, threading.Lock())
+        # Only requests for this same volume wait while it is being stacked
+        with lock:
+            if not os.path.isfile(volume_path):
+                with timed_stage('volume_build'):
+                    build_series_volume(entry, manifest['index']['source_file'], volume_path)
+        with volume_build_lock:
+            volume_build_locks.pop(volume_path, None)
+    return np.load(volume_path, mmap_mode='r')
+
+def nifti_volume_file(manifest, entry):
+    if not entry.get('archive'):
+        return entry['file']
+    source_file = manifest['index']['source_file']
+    file_path = os.path.join(os.path.dirname(source_file), ARCHIVE_EXTRACT_FOLDER, archive_member_path(entry['member']))
+    if not os.path.isfile(file_path):
+        # Restored from the result cache: the zip is in this workspace but its members were never extracted
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        with zipfile.ZipFile(source_file, 'r') as archive, archive.open(entry['member']) as member, \
+                open(temp_path, 'wb') as output:
+            shutil.copyfileobj(member, output, UPLOAD_CHUNK_BYTES)
+        os.replace(temp_path, file_path)
+    return file_path
+
+def volume_source(manifest, name, entry, volume=0):
+    # (sliceable data, axis numbers, trailing indices); NIfTI data stays a lazy proxy over the file
+    if entry.get('kind') == 'dicom':
+        return load_series_volume(manifest, name, entry), DICOM_AXES, ()
+    img = nib.load(nifti_volume_file(manifest, entry))
+    return img.dataobj, NIFTI_AXES, nifti_extra_indices(img.shape, volume)
+
+def reformat_plane(plane, ratio):
+    # Slices run along the plane's rows: put the highest position on top and stretch to the slice spacing
+    plane = plane[::-1]
+    if not np.isfinite(ratio) or ratio <= 0:
+        return plane
+    rows = max(1, int(round(plane.shape[0] * ratio)))
+    return plane[np.minimum((np.arange(rows) / ratio).astype(np.intp), plane.shape[0] - 1)]
+
+def volume_plane(entry, source, axis, index=None, start=None, end=None):
+    # A single slice when index is given, else the maximum-intensity projection of [start, end)
+    data, axes, extra = source
+    axis_number = axes[axis]
+    slicer = [slice(None)] * 3
+    slicer[axis_number] = index if index is not None else slice(start, end)
+    plane = np.asarray(data[tuple(slicer) + extra], dtype=np.float32)
+    if index is None:
+        plane = plane.max(axis=axis_number)
+    if entry.get('kind') == 'dicom' and axis != 'axial':
+        voxel_size = entry['voxel_size']
+        plane = reformat_plane(plane, voxel_size[0] / voxel_size[2 if axis == 'coronal' else 1])
+    return plane
+
+def volume_display(entry):
+    # ?center=&width= override the series window; returns the display and a cache-name suffix
+    center = request.args.get('center', type=float)
+    width = request.args.get('width', type=float)
+    if center is not None and width:
+        return {'slope': 1.0, 'intercept': 0.0, 'center': center, 'width': width}, f"_c{center:g}_w{width:g}"
+    window = entry.get('window')
+    if window and window['center'] is not None and window['width']:
+        return {'slope': 1.0, 'intercept': 0.0, **window}, ''
+    return None, ''
+
+# Thumbnail pyramid
+def write_pyramid(source, outputs):
+    # outputs are (path, longest side) pairs, largest first so each level shrinks the previous one
+    with Image.open(source) as image:
+        image.draft('RGB', (outputs[0][1], outputs[0][1]))
+        image = image.convert('RGB')
+        for output_path, size in outputs:
+            image.thumbnail((size, size))
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            image.save(output_path, quality=JPEG_QUALITY)
+
+def build_pyramid(upload_id, view_root):
+    pyramid_root = workspace_path(upload_id, PYRAMID_FOLDER)
+    os.makedirs(pyramid_root, exist_ok=True)
+    levels = sorted(PYRAMID_LEVELS.items(), key=lambda level: -level[1])
+
+    images = []
+    for root, dirs, files in os.walk(view_root):
+        for file in files:
+            if file.endswith(('.jpg', '.jpeg', '.png')):
+                images.append(os.path.relpath(os.path.join(root, file), view_root))
+
+    def build(relative_path):
+        write_pyramid(os.path.join(view_root, relative_path),
+                      [(os.path.join(pyramid_root, level, relative_path), size) for level, size in levels])
+
+    # Pillow releases the GIL while decoding and resampling
+    with ThreadPoolExecutor(max_workers=max(1, CONVERSION_WORKERS)) as executor:
+        list(executor.map(build, images))
+
 ## For DICOM Visualization
 # @app.route('/output-files/folder-images-metadata', methods=['GET'])
 # @cross_origin()
@@ -285,14 +1597,99 @@ FIELDS = [
     'TransferSyntaxUID', 'TriggerWindow', 'WindowCenter', 'WindowWidth'
 ]
 
-def convert_to_jpg(image_data, output_path):
-    plt.imshow(image_data, cmap=plt.cm.bone)
-    plt.axis('off')
-    plt.savefig(output_path, bbox_inches='tight', pad_inches=0)
-    plt.close()
+# matplotlib colormaps sampled into LUTs, so the direct renderer matches the matplotlib backend's colours
+def build_colormap_lut(colormap, size=256):
+    return np.round(colormap(np.linspace(0.0, 1.0, size))[:, :3] * 255).astype(np.uint8)
+
+# DICOM/NIfTI slices are drawn with "bone"; plt.imsave gives HDF5 images the default "viridis"
+BONE_LUT = build_colormap_lut(plt.cm.bone)
+VIRIDIS_LUT = build_colormap_lut(plt.cm.viridis)
+
+def first_value(value):
+    if isinstance(value, MultiValue):
+        return value[0] if len(value) else None
+    return value
+
+def dicom_display_window(ds):
+    center = first_value(getattr(ds, 'WindowCenter', None))
+    width = first_value(getattr(ds, 'WindowWidth', None))
+    return {
+        'slope': float(getattr(ds, 'RescaleSlope', 1) or 1),
+        'intercept': float(getattr(ds, 'RescaleIntercept', 0) or 0),
+        'center': float(center) if center not in (None, '') else None,
+        'width': float(width) if width not in (None, '') else None,
+    }
+
+def normalize_image(image_data, display=None):
+    image = np.asarray(image_data, dtype=np.float32)
+    if display:
+        image = image * display['slope'] + display['intercept']
+        if display['center'] is not None and display['width']:
+            lower = display['center'] - display['width'] / 2.0
+            return np.clip((image - lower) / display['width'], 0.0, 1.0)
+
+    low, high = np.nanmin(image), np.nanmax(image)
+    if high <= low:
+        return np.zeros(image.shape, dtype=np.float32)
+    return (image - low) / (high - low)
+
+def apply_lut(normalized, lut=BONE_LUT):
+    indices = np.nan_to_num(normalized * len(lut), nan=0.0)
+    return lut[np.clip(indices.astype(np.intp), 0, len(lut) - 1)]
+
+def encode_image(pixels, output_path):
+    Image.fromarray(pixels).save(output_path, quality=JPEG_QUALITY)
+
+def colour_pixels(image):
+    # RGB(A) data is shown as-is, like imshow does, instead of going through a colormap
+    pixels = image[..., :3]
+    if pixels.dtype == np.uint8:
+        return np.ascontiguousarray(pixels)
+    if np.issubdtype(pixels.dtype, np.floating):
+        # imshow/imsave clip float RGB to [0, 1] and integer RGB to [0, 255]
+        pixels = np.clip(np.nan_to_num(pixels), 0.0, 1.0) * 255
+    return np.ascontiguousarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+def is_colour_image(image):
+    return image.ndim == 3 and image.shape[-1] in (3, 4)
+
+def convert_to_jpg(image_data, output_path, display=None):
+    if RENDER_BACKEND == 'direct':
+        if is_colour_image(image_data):
+            encode_image(colour_pixels(image_data), output_path)
+        else:
+            encode_image(apply_lut(normalize_image(image_data, display)), output_path)
+        return
 
-def extract_dicom_metadata(dicom_path):
-    ds = pydicom.dcmread(dicom_path)
+    if display and display['center'] is not None and display['width']:
+        image_data, limits = normalize_image(image_data, display), {'vmin': 0.0, 'vmax': 1.0}
+    else:
+        limits = {}
+    # Conversion runs in-process on job threads when there is a single worker, next to /render requests
+    with pyplot_lock:
+        plt.imshow(image_data, cmap=plt.cm.bone, **limits)
+        plt.axis('off')
+        plt.savefig(output_path, bbox_inches='tight', pad_inches=0)
+        plt.close()
+
+def save_dataset_image(image, output_path):
+    if RENDER_BACKEND != 'direct':
+        with pyplot_lock:
+            plt.imsave(output_path, image)
+        return
+
+    if is_colour_image(image):
+        encode_image(colour_pixels(image), output_path)
+    else:
+        encode_image(np.ascontiguousarray(apply_lut(normalize_image(image), VIRIDIS_LUT)), output_path)
+
+def read_dicom_header(dicom_path):
+    # Skips (and never decodes) the pixel data element; enough for metadata and indexing
+    return pydicom.dcmread(dicom_path, stop_before_pixels=True)
+
+def extract_dicom_metadata(ds):
+    if not isinstance(ds, pydicom.Dataset):
+        ds = read_dicom_header(ds)
     metadata = {}
     for field in FIELDS:
         if hasattr(ds, field):
@@ -304,8 +1701,37 @@ def convert_np_float32(obj):
         return float(obj)
     raise TypeError
 
-def extract_nifti_metadata(nifti_path):
-    img = nib.load(nifti_path)
+def query_metadata_store(store_path, offset, limit, fields=None, filters=None):
+    total = 0
+    records = []
+    with open(store_path, 'r') as store_file:
+        for line in store_file:
+            in_page = offset <= total < offset + limit
+            # Without filters, lines outside the requested page are only counted, never parsed
+            if not filters and not in_page:
+                total += 1
+                continue
+            record = json.loads(line)
+            if filters and any(str(record.get(tag)) != value for tag, value in filters.items()):
+                continue
+            if in_page:
+                if fields:
+                    record = {field: record[field] for field in fields if field in record}
+                records.append(record)
+            total += 1
+    return total, records
+
+def metadata_query_args():
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', METADATA_PAGE_SIZE, type=int)), 10 * METADATA_PAGE_SIZE)
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    # Only DICOM tags are filters, so cache-busters and other unrelated parameters are ignored
+    filters = {tag: value for tag, value in request.args.items() if tag in FIELDS}
+    return offset, limit, fields, filters
+
+def extract_nifti_metadata(img):
+    if isinstance(img, (str, os.PathLike)):
+        img = nib.load(img)
     header = img.header
     metadata = {
         "dim": header.get_data_shape(),
@@ -321,124 +1747,435 @@ def extract_nifti_metadata(nifti_path):
             metadata[key] = float(value)
     return metadata
 
-def create_output_structure(input_folder, output_folder):
-    for root, dirs, files in os.walk(input_folder):
-        for dir_name in dirs:
-            relative_path = os.path.relpath(os.path.join(root, dir_name), input_folder)
-            os.makedirs(os.path.join(output_folder, relative_path, 'image'), exist_ok=True)
-            os.makedirs(os.path.join(output_folder, relative_path, 'meta'), exist_ok=True)
-            os.makedirs(os.path.join(output_folder, relative_path, 'text'), exist_ok=True)
-
-def process_files(input_folder, output_folder):
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-
-            if file.endswith('.dcm'):
-                relative_path = os.path.relpath(root, input_folder)
-
-                image_name = os.path.splitext(file)[0] + '.jpg'
-                image_output_path = os.path.join(output_folder, relative_path, 'image', image_name.replace("./", ''))
-                meta_output_path = os.path.join(output_folder, relative_path, 'meta', os.path.splitext(file)[0] + '.json')
-                text_output_path = os.path.join(output_folder, relative_path, 'text', 'file.txt')
-
-                os.makedirs(os.path.dirname(image_output_path), exist_ok=True)
-
-                ds = pydicom.dcmread(file_path)
-                convert_to_jpg(ds.pixel_array, image_output_path)
-
-                metadata = extract_dicom_metadata(file_path)
-
-                with open(meta_output_path, 'w') as meta_file:
-                    json.dump(metadata, meta_file, default=convert_np_float32, indent=4)
-
-                os.makedirs(os.path.dirname(text_output_path), exist_ok=True)
-                with open(text_output_path, 'a') as text_file:
-                    text_file.write(f'{{"{image_name}": "{os.path.basename(meta_output_path)}"}}\n')
-
-            elif file.endswith('.nii') or file.endswith('.nii.gz'):
-                try:
-                    img = nib.load(file_path)
-                except nib.filebasedimages.ImageFileError:
-                    print(f"Skipping file: {file_path} - Not a valid NIfTI file")
-                    continue
-
-                relative_path = os.path.relpath(root, input_folder)
-                image_name = os.path.splitext(file)[0] + '.jpg'
-                image_output_path = os.path.join(output_folder, relative_path, 'image', image_name.replace("./", ''))
-                meta_output_path = os.path.join(output_folder, relative_path, 'meta', os.path.splitext(file)[0] + '.json')
-                text_output_path = os.path.join(output_folder, relative_path, 'text', 'file.txt')
-
-                os.makedirs(os.path.dirname(image_output_path), exist_ok=True)
-
-                data = img.get_fdata()
-                middle_slice = data[:, :, data.shape[2] // 2]
-
-                convert_to_jpg(middle_slice, image_output_path)
-
-                metadata = extract_nifti_metadata(file_path)
+NIFTI_AXES = {'sagittal': 0, 'coronal': 1, 'axial': 2}
+# Series volumes are stacked slice-first: (slice, row, column)
+DICOM_AXES = {'axial': 0, 'coronal': 1, 'sagittal': 2}
+
+def nifti_slice(img, axis='axial', index=None, volume=0):
+    # Slicing dataobj reads only the requested plane from the (memory-mapped) file
+    if len(img.shape) == 2:
+        return np.asarray(img.dataobj)
+    axis_number = NIFTI_AXES[axis]
+    if index is None:
+        index = img.shape[axis_number] // 2
+    slicer = [slice(None)] * 3
+    slicer[axis_number] = index
+    return np.asarray(img.dataobj[tuple(slicer) + nifti_extra_indices(img.shape, volume)])
+
+def nifti_extra_indices(shape, volume=0):
+    # Picks the time point on the 4th axis and the first entry of every axis after it
+    return (volume,) + (0,) * (len(shape) - 4) if len(shape) > 3 else ()
+
+def nifti_volume_info(img, file_path, member=None):
+    shape = [int(size) for size in img.shape]
+    # Members are re-read from the upload's zip, so the entry stays valid in a workspace restored from cache
+    source = {'member': member, 'archive': True} if member else {'file': file_path}
+    return {
+        **source,
+        'shape': shape,
+        'voxel_size': [float(zoom) for zoom in img.header.get_zooms()],
+        'axes': {axis: shape[axis_number] for axis, axis_number in NIFTI_AXES.items()},
+        'volumes': shape[3] if len(shape) > 3 else 1,
+    }
 
-                with open(meta_output_path, 'w') as meta_file:
-                    json.dump(metadata, meta_file, default=convert_np_float32, indent=4)
+def dicom_floats(ds, name):
+    value = getattr(ds, name, None)
+    if value in (None, ''):
+        return None
+    try:
+        return [float(item) for item in value] if isinstance(value, MultiValue) else [float(value)]
+    except (TypeError, ValueError):
+        return None
+
+def dicom_geometry(ds):
+    # Everything needed to place the slice in its series; picklable so workers can return it
+    instance = getattr(ds, 'InstanceNumber', None)
+    thickness = getattr(ds, 'SliceThickness', None)
+    return {
+        'series': str(getattr(ds, 'SeriesInstanceUID', '') or ''),
+        'description': str(getattr(ds, 'SeriesDescription', '') or ''),
+        'modality': str(getattr(ds, 'Modality', '') or ''),
+        'position': dicom_floats(ds, 'ImagePositionPatient'),
+        'orientation': dicom_floats(ds, 'ImageOrientationPatient'),
+        'spacing': dicom_floats(ds, 'PixelSpacing'),
+        'thickness': float(thickness) if thickness not in (None, '') else None,
+        'instance': int(instance) if instance not in (None, '') else None,
+        'rows': int(getattr(ds, 'Rows', 0) or 0),
+        'columns': int(getattr(ds, 'Columns', 0) or 0),
+        'frames': int(getattr(ds, 'NumberOfFrames', 1) or 1),
+        'samples': int(getattr(ds, 'SamplesPerPixel', 1) or 1),
+        **dicom_display_window(ds),
+    }
 
-                os.makedirs(os.path.dirname(text_output_path), exist_ok=True)
-                with open(text_output_path, 'a') as text_file:
-                    text_file.write(f'{{"{image_name}": "{os.path.basename(meta_output_path)}"}}\n')
+def dicom_series_info(slices, archive):
+    first = slices[0][0]
+    if len(slices) < 2 or any((g['rows'], g['columns']) != (first['rows'], first['columns']) for g, _ in slices):
+        return None
+
+    # Sort along the slice normal when the geometry is complete, else by InstanceNumber
+    positions = None
+    orientation = first['orientation']
+    if orientation and len(orientation) == 6 and all(g['position'] and len(g['position']) == 3 for g, _ in slices):
+        normal = np.cross(orientation[:3], orientation[3:])
+        positions = [float(np.dot(g['position'], normal)) for g, _ in slices]
+        order = np.argsort(positions, kind='stable')
+    elif all(g['instance'] is not None for g, _ in slices):
+        order = np.argsort([g['instance'] for g, _ in slices], kind='stable')
+    else:
+        order = np.arange(len(slices))
+
+    spacing = first['thickness'] or 1.0
+    if positions is not None:
+        steps = np.abs(np.diff(np.sort(positions)))
+        if steps.size and np.median(steps) > 0:
+            spacing = float(np.median(steps))
+    pixel_spacing = first['spacing'] if first['spacing'] and len(first['spacing']) >= 2 else [1.0, 1.0]
+    row_spacing, column_spacing = pixel_spacing[:2]
+
+    ordered = [slices[i] for i in order]
+    shape = [len(ordered), first['rows'], first['columns']]
+    return {
+        'kind': 'dicom',
+        'series_uid': first['series'],
+        'description': first['description'],
+        'modality': first['modality'],
+        'archive': archive,
+        'shape': shape,
+        'voxel_size': [spacing, row_spacing, column_spacing],
+        'axes': {axis: shape[axis_number] for axis, axis_number in DICOM_AXES.items()},
+        'volumes': 1,
+        'window': {'center': first['center'], 'width': first['width']},
+        'slices': [{'source': source, 'slope': g['slope'], 'intercept': g['intercept']} for g, source in ordered],
+    }
 
-def delete_empty_folders(): 
-    root = 'output'
-    deleted = set()
-    for current_dir, subdirs, files in os.walk(root, topdown=False):
+def conversion_task(input_folder, relative_path, file, output_folder, render=True):
+    if file.endswith('.dcm'):
+        kind = 'dicom'
+    elif file.endswith('.nii') or file.endswith('.nii.gz'):
+        kind = 'nifti'
+    else:
+        return None
+
+    image_name = os.path.splitext(file)[0] + '.jpg'
+    return {
+        'kind': kind,
+        'render': render,
+        'file_path': os.path.join(input_folder, relative_path, file),
+        'folder': os.path.normpath(relative_path),
+        'image_name': image_name,
+        'image_output_path': os.path.join(output_folder, relative_path, 'image', image_name.replace("./", '')),
+        'meta_output_path': os.path.join(output_folder, relative_path, 'meta', os.path.splitext(file)[0] + '.json'),
+        'text_output_path': os.path.join(output_folder, relative_path, 'text', 'file.txt'),
+    }
 
-        still_has_subdirs = False
-        for subdir in subdirs:
-            if os.path.join(current_dir, subdir) not in deleted:
-                still_has_subdirs = True
-                break
-        if not any(files) and not still_has_subdirs:
-            os.rmdir(current_dir)
-    return deleted
-
-def output_for_visualization():
-    i = 0
-    for dirpath, dirnames, files in os.walk('output'):
-        for dir in dirnames:
-            if (dir == 'image'):
-                print(os.path.join(dirpath, dir))
-                shutil.copytree(os.path.join(dirpath, dir), os.path.join('outputView', 'imageNew' + str(i)))
-            if (dir == 'meta'):
-                print(os.path.join(dirpath, dir))
-                shutil.copytree(os.path.join(dirpath, dir), os.path.join('outputView', 'metaNew' + str(i)))
-            if (dir == 'text'):
-                print(os.path.join(dirpath, dir))
-                shutil.copytree(os.path.join(dirpath, dir), os.path.join('outputView','textNew' + str(i)))
-                i += 1
-    return 0
-
-def mainDICOMMethod(input_folder, output_folder):
+def collect_conversion_tasks(input_folder, output_folder, render=True):
+    tasks = []
+    for root, dirs, files in os.walk(input_folder):
+        # Sorted so outputView numbering (imageNew0, imageNew1, ...) is stable between runs
+        dirs.sort()
+        for file in sorted(files):
+            task = conversion_task(input_folder, os.path.relpath(root, input_folder), file, output_folder, render)
+            if task:
+                tasks.append(task)
+    return tasks
+
+def archive_member_path(name):
+    # Same sanitising as ZipFile.extract, so extracted members land where the stream mode says they are
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return os.path.join(*parts) if parts else None
+
+def archive_walk_key(member_path):
+    # Orders members like os.walk with sorted dirs: a folder's files before its subfolders
+    parts = member_path.split(os.sep)
+    return [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+
+def collect_archive_tasks(archive, input_folder, output_folder, render=True):
+    members = {}
+    for info in archive.infolist():
+        member_path = archive_member_path(info.filename)
+        if not info.is_dir() and member_path:
+            members[member_path] = info.filename
+
+    tasks = []
+    for member_path in sorted(members, key=archive_walk_key):
+        relative_path, file = os.path.split(member_path)
+        task = conversion_task(input_folder, relative_path or '.', file, output_folder, render)
+        if task:
+            task['member'] = members[member_path]
+            # nibabel and the lazy renderer open sources by path, so those members go to disk
+            task['extract'] = task['kind'] == 'nifti' or not render
+            tasks.append(task)
+    return tasks
+
+def load_archive_member(archive, task):
+    with timed_stage('zip_read'), archive.open(task['member']) as member:
+        if not task['extract']:
+            return {**task, 'data': member.read()}
+        os.makedirs(os.path.dirname(task['file_path']), exist_ok=True)
+        with open(task['file_path'], 'wb') as output:
+            shutil.copyfileobj(member, output, UPLOAD_CHUNK_BYTES)
+    return task
+
+def prefetch_tasks(tasks, load, depth=ZIP_PREFETCH_MEMBERS):
+    # Producer thread decompresses members while the caller converts the ones already read
+    buffer = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    finished = object()
+    timings = getattr(timing_context, 'timings', None)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        timing_context.timings = timings
+        try:
+            for task in tasks:
+                if not put(load(task)):
+                    return
+            put(finished)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+def task_source(task):
+    return BytesIO(task['data']) if 'data' in task else task['file_path']
+
+def convert_file(task):
+    file_path = task['file_path']
+    image_output_path = task['image_output_path']
+    meta_output_path = task['meta_output_path']
+    # Stage timings are measured in the worker and merged by the parent process
+    timings = {}
+    start = time.perf_counter()
+
+    if task['kind'] == 'dicom' and not task['render']:
+        ds = read_dicom_header(task_source(task))
+        start = lap(timings, 'dicom_read', start)
+        metadata = extract_dicom_metadata(ds)
+        geometry = dicom_geometry(ds)
+        start = lap(timings, 'metadata_extract', start)
+    elif task['kind'] == 'dicom':
+        os.makedirs(os.path.dirname(image_output_path), exist_ok=True)
+
+        ds = pydicom.dcmread(task_source(task))
+        pixels = ds.pixel_array
+        start = lap(timings, 'dicom_read', start)
+        convert_to_jpg(pixels, image_output_path, dicom_display_window(ds))
+        start = lap(timings, 'render', start)
+
+        metadata = extract_dicom_metadata(ds)
+        geometry = dicom_geometry(ds)
+        start = lap(timings, 'metadata_extract', start)
+    else:
+        geometry = None
+        try:
+            img = nib.load(file_path)
+        except nib.filebasedimages.ImageFileError:
+            print(f"Skipping file: {file_path} - Not a valid NIfTI file")
+            return None
+        start = lap(timings, 'nifti_read', start)
+
+        if task['render']:
+            os.makedirs(os.path.dirname(image_output_path), exist_ok=True)
+            convert_to_jpg(nifti_slice(img), image_output_path)
+            start = lap(timings, 'render', start)
+
+        metadata = extract_nifti_metadata(img)
+        start = lap(timings, 'metadata_extract', start)
+
+    if METADATA_PER_SLICE_FILES:
+        os.makedirs(os.path.dirname(meta_output_path), exist_ok=True)
+        with open(meta_output_path, 'w') as meta_file:
+            json.dump(metadata, meta_file, default=convert_np_float32, indent=4)
+        lap(timings, 'json_write', start)
+
+    # Without per-slice files the slice's metadata is the record for this image in the folder's store
+    meta_name = os.path.basename(meta_output_path) if METADATA_PER_SLICE_FILES else METADATA_STORE_FILE
+    return f'{{"{task["image_name"]}": "{meta_name}"}}\n', metadata, timings, geometry
+
+def get_conversion_pool():
+    global conversion_pool
+    with conversion_pool_lock:
+        if conversion_pool is None:
+            # Jobs run on background threads, so avoid forking the multi-threaded server process
+            context = multiprocessing.get_context('forkserver')
+            # Import this module once in the forkserver; workers forked from it skip the heavy imports
+            context.set_forkserver_preload([convert_file.__module__])
+            conversion_pool = ProcessPoolExecutor(max_workers=CONVERSION_WORKERS, mp_context=context)
+        return conversion_pool
+
+def discard_conversion_pool(pool):
+    global conversion_pool
+    with conversion_pool_lock:
+        if conversion_pool is pool:
+            conversion_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def run_conversion_tasks(tasks, load=None):
+    workers = min(CONVERSION_WORKERS, len(tasks))
+    source = tasks if load is None else prefetch_tasks(tasks, load)
+    if workers <= 1 or len(tasks) < CONVERSION_POOL_MIN_TASKS:
+        yield from map(convert_file, source)
+        return
+
+    executor = get_conversion_pool()
+    pending = deque()
+    try:
+        if load is None:
+            # executor.map keeps submission order, so file.txt is written exactly as in a serial walk
+            chunksize = max(1, len(tasks) // (workers * 4))
+            yield from executor.map(convert_file, tasks, chunksize=chunksize)
+            return
+
+        # executor.map would read every member up front; keep a bounded, ordered window in flight instead
+        for task in source:
+            pending.append(executor.submit(convert_file, task))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); start a fresh pool for the next job
+        discard_conversion_pool(executor)
+        raise
+    finally:
+        # The pool outlives this job, so drop whatever a failed job still had queued
+        for future in pending:
+            future.cancel()
+
+def view_folder_names(view_folder, index):
+    return {kind: os.path.join(view_folder, f'{kind}New{index}') for kind in ('image', 'meta', 'text')}
+
+def process_files(input_folder, output_folder, progress=None, render_index=None, volume_index=None, view_folder=None,
+                  archive=None):
+    if archive is None:
+        tasks, load = collect_conversion_tasks(input_folder, output_folder, render=render_index is None), None
+    else:
+        tasks = collect_archive_tasks(archive, input_folder, output_folder, render=render_index is None)
+        load = lambda task: load_archive_member(archive, task)
+    # Source folder -> its flattened outputView folders, numbered in order of first converted file
+    view_folders = {}
+    series = defaultdict(list)
+    for index, (task, result) in enumerate(zip(tasks, run_conversion_tasks(tasks, load))):
+        if progress:
+            progress(index + 1, len(tasks))
+        if result is None:
+            continue
+        text_line, metadata, timings, geometry = result
+        for stage, seconds in timings.items():
+            record_stage(stage, seconds)
+
+        if volume_index is not None and geometry and geometry['frames'] == 1 and geometry['samples'] == 1:
+            # Read back from the zip by member name when streaming, from the extracted file otherwise
+            source = task['member'] if archive is not None else task['file_path']
+            series[geometry['series'] or task['folder']].append((geometry, source))
+
+        if view_folder is not None:
+            view = view_folders.get(task['folder'])
+            if view is None:
+                view = view_folders[task['folder']] = view_folder_names(view_folder, len(view_folders))
+                for path in view.values():
+                    os.makedirs(path, exist_ok=True)
+                if render_index is not None:
+                    # Lazily rendered image folders were never written, so alias them under their view name
+                    image_folder = os.path.relpath(os.path.dirname(task['image_output_path']), output_folder)
+                    render_index['folders'][os.path.basename(view['image'])] = render_index['folders'].setdefault(
+                        image_folder, {'source': 'files', 'items': [], 'count': 0})
+            with timed_stage('view_link'):
+                if task['render']:
+                    link_file(task['image_output_path'], os.path.join(view['image'], os.path.basename(task['image_output_path'])))
+                if METADATA_PER_SLICE_FILES:
+                    link_file(task['meta_output_path'], os.path.join(view['meta'], os.path.basename(task['meta_output_path'])))
+
+        if volume_index is not None and task['kind'] == 'nifti':
+            img = nib.load(task['file_path'])
+            if len(img.shape) >= 3:
+                volume_index[os.path.relpath(task['file_path'], input_folder)] = nifti_volume_info(
+                    img, task['file_path'], task['member'] if archive is not None else None)
+
+        if render_index is not None:
+            image_folder = os.path.relpath(os.path.dirname(task['image_output_path']), output_folder)
+            entry = render_index['folders'].setdefault(image_folder, {'source': 'files', 'items': [], 'count': 0})
+            entry['items'].append({'kind': task['kind'], 'file': task['file_path'], 'name': task['image_name']})
+            entry['count'] += 1
+
+        with timed_stage('json_write'):
+            text_output_path = task['text_output_path']
+            os.makedirs(os.path.dirname(text_output_path), exist_ok=True)
+            with open(text_output_path, 'a') as text_file:
+                text_file.write(text_line)
+
+            store_path = os.path.join(os.path.dirname(task['meta_output_path']), METADATA_STORE_FILE)
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            record = {'file': os.path.basename(task['meta_output_path']), 'image': task['image_name'], **metadata}
+            with open(store_path, 'a') as store_file:
+                store_file.write(json.dumps(record, default=convert_np_float32) + '\n')
+
+    # file.txt and the metadata store are appended to above, so link them once they are complete
+    with timed_stage('view_link'):
+        for folder, view in view_folders.items():
+            for kind, name in (('text', 'file.txt'), ('meta', METADATA_STORE_FILE)):
+                link_file(os.path.join(output_folder, folder, kind, name), os.path.join(view[kind], name))
+
+    for name, slices in series.items():
+        entry = dicom_series_info(slices, archive is not None)
+        if entry:
+            volume_index[name] = entry
+
+def mainDICOMMethod(input_folder, output_folder, view_folder, progress=None, render_index=None, volume_index=None,
+                    archive=None):
     isDicom = True
-    isExist = os.path.exists('outputView')
+    isExist = os.path.exists(view_folder)
     if(isExist):
         print("outputView exists")
     else:
-        os.mkdir('outputView')
-    create_output_structure(input_folder, output_folder)
-    process_files(input_folder, output_folder)
-    delete_empty_folders()
-    output_for_visualization()
+        os.mkdir(view_folder)
+    # Output folders are created as files are converted, and the outputView folders hardlink
+    # into them during the same pass, so there is neither an empty-folder sweep nor a copy
+    process_files(input_folder, output_folder, progress, render_index, volume_index, view_folder, archive)
 
 # HDF5 Parser
-def mainHDF5Method(file_path):
+def mainHDF5Method(file_path, output_folder, progress=None, render_index=None):
     isHDF5 = True
     path_to_dataset = {}
     with h5py.File(file_path, 'r') as file:
-        file.visititems(lambda name, obj: traverse_hdf5(name, obj, path_to_dataset))
+        dataset_names = []
+        file.visititems(lambda name, obj: dataset_names.append(name) if isinstance(obj, h5py.Dataset) else None)
+        processed = 0
+
+        def visit(name, obj):
+            nonlocal processed
+            traverse_hdf5(name, obj, path_to_dataset, output_folder, render_index)
+            if progress and isinstance(obj, h5py.Dataset):
+                processed += 1
+                progress(processed, len(dataset_names))
+
+        file.visititems(visit)
 
-    output_json_path = os.path.join('output', 'nestedDict.json')
-    with open(output_json_path, 'w') as json_file:
+    output_json_path = os.path.join(output_folder, 'nestedDict.json')
+    with timed_stage('json_write'), open(output_json_path, 'w') as json_file:
         json.dump(path_to_dataset, json_file, indent=True)
 
-def traverse_hdf5(name, obj, path_to_dataset):
+def traverse_hdf5(name, obj, path_to_dataset, output_folder, render_index=None):
     if isinstance(obj, h5py.Group):
         if '/' in name:
             current_dict = path_to_dataset
@@ -457,51 +2194,97 @@ def traverse_hdf5(name, obj, path_to_dataset):
             filePath = filePath + folder
         dataset_name = folders[-1]
 
+        # nestedDict.json keeps paths relative to the workspace, e.g. output/xImages
         if (("X" in name or "data" in name or "image" in name) and obj.ndim >= 2):
-            image_folder = os.path.join('output', filePath + dataset_name + "Images")
-            os.makedirs(image_folder, exist_ok=True)
-            imageDatasetHandling(obj, image_folder)
-            current_dict[dataset_name] = image_folder
+            image_folder = filePath + dataset_name + "Images"
+            os.makedirs(os.path.join(output_folder, image_folder), exist_ok=True)
+            if render_index is not None:
+                render_index['folders'][image_folder] = {
+                    'source': 'hdf5', 'dataset': name, 'count': obj.shape[0],
+                    'shape': list(obj.shape), 'dtype': str(obj.dtype),
+                }
+            else:
+                with timed_stage('hdf5_image_export'):
+                    imageDatasetHandling(obj, os.path.join(output_folder, image_folder))
+            current_dict[dataset_name] = os.path.join(OUTPUT_FOLDER, image_folder)
         elif obj.ndim >= 2:
-            data_path = os.path.join('output', filePath + dataset_name + "Data.npy")
-            np.save(data_path, np.array(obj))
-            current_dict[dataset_name] = data_path
+            data_path = filePath + dataset_name + "Data.npy"
+            with timed_stage('hdf5_array_export'):
+                save_array(obj, os.path.join(output_folder, data_path))
+            current_dict[dataset_name] = os.path.join(OUTPUT_FOLDER, data_path)
         elif obj.ndim == 1:
-            labels_path = os.path.join('output', filePath + dataset_name + "Labels.json")
-            save_labels(obj, labels_path)
-            current_dict[dataset_name] = labels_path
+            labels_path = filePath + dataset_name + "Labels.json"
+            with timed_stage('hdf5_labels_export'):
+                save_labels(obj, os.path.join(output_folder, labels_path))
+            current_dict[dataset_name] = os.path.join(OUTPUT_FOLDER, labels_path)
+
+def save_array(obj, data_path):
+    if h5py.check_string_dtype(obj.dtype) is not None:
+        # Variable-length strings become fixed-width unicode so the export stays memory-mappable
+        np.save(data_path, np.array(obj.asstr()[()], dtype=str))
+        return
+    if obj.dtype.hasobject:
+        # Other variable-length data has no fixed-size on-disk layout to stream into
+        np.save(data_path, np.array(obj))
+        return
+
+    array = np.lib.format.open_memmap(data_path, mode='w+', dtype=obj.dtype, shape=obj.shape)
+    for start, slab in iter_dataset_slabs(obj):
+        array[start:start + slab.shape[0]] = slab
+    array.flush()
+    del array
 
 def save_labels(obj, labels_path):
     labels = np.array(obj)
     num_images = labels.shape[0]
-    label_dict = {}
 
-    for i in range(num_images):
-        if isinstance(labels[i], bytes):
-            label = labels[i].decode()
-        elif isinstance(labels[i], str):
-            label = labels[i]
-        else:
-            label = int(labels[i])
-        label_dict[f"img{i}.jpg"] = label
+    if labels.dtype.kind == 'S':
+        values = np.char.decode(labels).tolist()
+    elif labels.dtype.kind == 'U':
+        values = labels.tolist()
+    elif labels.dtype.hasobject:
+        values = [label.decode() if isinstance(label, bytes) else label if isinstance(label, str) else int(label)
+                  for label in labels]
+    else:
+        values = labels.astype(np.int64).tolist()
+    label_dict = dict(zip([f"img{i}.jpg" for i in range(num_images)], values))
 
     with open(labels_path, 'w') as json_file:
         json.dump(label_dict, json_file, indent=True)
 
+def dataset_slab_rows(dataset):
+    row_items = int(np.prod(dataset.shape[1:], dtype=np.int64))
+    # abs() and the /255 rescale each produce a float64 working copy of the slab
+    row_bytes = max(1, row_items * (dataset.dtype.itemsize + 2 * 8))
+    rows = max(1, HDF5_EXPORT_MAX_BYTES // row_bytes)
+    chunks = getattr(dataset, 'chunks', None)
+    if chunks and rows >= chunks[0]:
+        rows = rows // chunks[0] * chunks[0]
+    return min(rows, max(1, dataset.shape[0]))
+
+def iter_dataset_slabs(dataset):
+    step = dataset_slab_rows(dataset)
+    for start in range(0, dataset.shape[0], step):
+        yield start, dataset[start:start + step]
+
 def imageDatasetHandling(dataset, folder_name):
-    dataset = np.array(dataset)
-    dataset = np.abs(dataset)
-    scale_down = np.max(dataset) > 1
-
-    if scale_down:
-        dataset = dataset / 255.0
-
-    size_of_dataset = dataset.shape[0]
-    for i in range(size_of_dataset):
-        image = dataset[i]
-        if dataset.ndim == 2:
-            image = image.reshape(int(math.sqrt(dataset.shape[1])), int(math.sqrt(dataset.shape[1])))
-        plt.imsave(os.path.join(folder_name, f"img{i}.jpg"), image)
+    if dataset.shape[0] == 0:
+        return
+
+    # First pass only needs the global max to decide on scale_down
+    dataset_max = max(np.max(np.abs(slab)) for _, slab in iter_dataset_slabs(dataset))
+    scale_down = dataset_max > 1
+
+    for start, slab in iter_dataset_slabs(dataset):
+        slab = np.abs(slab)
+        if scale_down:
+            slab = slab / 255.0
+
+        for offset in range(slab.shape[0]):
+            image = slab[offset]
+            if dataset.ndim == 2:
+                image = image.reshape(int(math.sqrt(dataset.shape[1])), int(math.sqrt(dataset.shape[1])))
+            save_dataset_image(image, os.path.join(folder_name, f"img{start + offset}.jpg"))
 
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'h5', 'hdf5', 'dcm', 'dicom', 'nii', 'zip'}
@@ -23,6 +23,8 @@ function MainPage() {
   const [error, setError] = useState(null);
   const [fileType, setFileType] = useState('');
   const [uploadingFileLoading, setUploadingFileLoading] = useState(false)
+  const [uploadProgress, setUploadProgress] = useState(null);
+  const [uploadId, setUploadId] = useState(null);
 
   const [modalIsOpen, setModalIsOpen] = useState(false);
   const [previewFile, setPreviewFile] = useState(null);
@@ -37,20 +39,64 @@ function MainPage() {
     setSelectedFile(files);
   };
 
+  const pollJob = (jobId) => new Promise((resolve, reject) => {
+    const checkJob = () => {
+      axios.get(`http://127.0.0.1:5000/jobs/${jobId}`)
+        .then(response => {
+          const job = response.data;
+          setUploadProgress(job.percent);
+          if (job.state === 'done') {
+            resolve(job);
+          } else if (job.state === 'failed') {
+            reject(new Error(job.error));
+          } else {
+            setTimeout(checkJob, 1000);
+          }
+        })
+        .catch(reject);
+    };
+    checkJob();
+  });
+
+  // Sends the file in ranges so an interrupted transfer only resends what the server is missing
+  const uploadInChunks = async (file) => {
+    let session = (await axios.post(`http://127.0.0.1:5000/uploads`, { file_name: file.name, file_size: file.size })).data;
+    for (let attempt = 0; session.missing.length > 0 && attempt < 5; attempt++) {
+      try {
+        for (const [start, end] of session.missing) {
+          for (let offset = start; offset < end; offset += session.chunk_size) {
+            const last = Math.min(offset + session.chunk_size, end);
+            await axios.put(`http://127.0.0.1:5000/uploads/${session.upload_id}`, file.slice(offset, last), {
+              headers: {
+                'Content-Type': 'application/octet-stream',
+                'Content-Range': `bytes ${offset}-${last - 1}/${file.size}`,
+              }
+            });
+          }
+        }
+      } catch (error) {
+        console.error('Chunk upload interrupted, resuming:', error);
+        await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+      }
+      session = (await axios.get(`http://127.0.0.1:5000/uploads/${session.upload_id}`)).data;
+    }
+    if (session.missing.length > 0) {
+      throw new Error('Upload could not be completed');
+    }
+    return axios.post(`http://127.0.0.1:5000/uploads/${session.upload_id}/finalize`);
+  };
+
   const handleUpload = () => {
     if (selectedFile) {
-      const formData = new FormData();
-      formData.append('file', selectedFile[0]);
-
       setUploadingFileLoading(true);
-      axios.post(`http://127.0.0.1:5000/upload`, formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        }
-      })
+      uploadInChunks(selectedFile[0])
       .then(response => {
         console.log(`${fileType} file upload successful:`, response.data);
-        fileType === 'HDF5' ? fetchOutputHDF5Files() : fetchOutputDICOMFiles(); // Refresh the output files list after upload
+        setUploadId(response.data.upload_id);
+        return pollJob(response.data.job_id);
+      })
+      .then(job => {
+        fileType === 'HDF5' ? fetchOutputHDF5Files('', job.id) : fetchOutputDICOMFiles('', job.id); // Refresh the output files list after processing
       })
       .catch(error => {
         console.error(`Error uploading ${fileType} file:`, error);
@@ -58,15 +104,16 @@ function MainPage() {
       })
       .finally(() => {
         setUploadingFileLoading(false);
+        setUploadProgress(null);
       });
     } else {
       setError('No file selected');
     }
   };
 
-  const fetchOutputHDF5Files = (path = '') => {
+  const fetchOutputHDF5Files = (path = '', id = uploadId) => {
     setLoading(true);
-    axios.get(`http://127.0.0.1:5000/output-files?path=${path}`)
+    axios.get(`http://127.0.0.1:5000/output-files?path=${path}&upload_id=${id}`)
       .then(response => {
         console.log('Fetched HDF5 output files:', response.data);
         setOutputHDF5Files(response.data);
@@ -82,9 +129,9 @@ function MainPage() {
       });
   };
 
-  const fetchOutputDICOMFiles = (path = '') => {
+  const fetchOutputDICOMFiles = (path = '', id = uploadId) => {
     setLoading(true);
-    axios.get(`http://127.0.0.1:5000/output-files?path=${path}`)
+    axios.get(`http://127.0.0.1:5000/output-files?path=${path}&upload_id=${id}`)
       .then(response => {
         console.log('Fetched DICOM output files:', response.data);
         setOutputDICOMFiles(response.data);
@@ -102,7 +149,7 @@ function MainPage() {
 
   const downloadFile = (filename) => {
     setLoading(true);
-    axios.get(`http://127.0.0.1:5000/output-files/${filename}`, {
+    axios.get(`http://127.0.0.1:5000/output-files/${filename}?upload_id=${uploadId}`, {
       responseType: 'blob',
     })
     .then(response => {
@@ -124,26 +171,13 @@ function MainPage() {
   };
 
   const downloadFolder = (foldername) => {
-    setLoading(true);
-    axios.get(`http://127.0.0.1:5000/output-files/download-folder?folder=${foldername}`, {
-      responseType: 'blob',
-    })
-    .then(response => {
-      const url = window.URL.createObjectURL(new Blob([response.data]));
-      const link = document.createElement('a');
-      link.href = url;
-      link.setAttribute('download', `${foldername}.zip`);
-      document.body.appendChild(link);
-      link.click();
-      link.remove();
-    })
-    .catch(error => {
-      console.error('Error downloading folder:', error);
-      setError('Error downloading folder.');
-    })
-    .finally(() => {
-      setLoading(false);
-    });
+    // The archive is streamed, so let the browser write it to disk instead of buffering a blob
+    const link = document.createElement('a');
+    link.href = `http://127.0.0.1:5000/output-files/download-folder?folder=${foldername}&upload_id=${uploadId}`;
+    link.setAttribute('download', `${foldername}.zip`);
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
   };
 
   const openModal = (file) => {
@@ -157,7 +191,7 @@ function MainPage() {
   };
 
   const openImageGalleryModal = (folder) => {
-    axios.get(`http://127.0.0.1:5000/output-files/folder-images?folder=${folder}`)
+    axios.get(`http://127.0.0.1:5000/output-files/folder-images?folder=${folder}&upload_id=${uploadId}`)
       .then(response => {
         setImageGallery(response.data);
         setImageGalleryModalIsOpen(true);
@@ -173,11 +207,15 @@ function MainPage() {
     setImageGalleryModalIsOpen(false);
   };
 
-  const fetchMetadataAndTextFiles = (folder) => {
+  // The server pages slice metadata; later pages are appended to what the modal already shows
+  const fetchMetadataAndTextFiles = (folder, offset = 0) => {
     setLoading(true);
-    axios.get(`http://127.0.0.1:5000/output-files/folder-metadata-text?folder=${folder}`)
+    axios.get(`http://127.0.0.1:5000/output-files/folder-metadata-text?folder=${folder}&offset=${offset}&upload_id=${uploadId}`)
       .then(response => {
-        setMetadataTextFiles(response.data);
+        setMetadataTextFiles(previous => offset === 0 ? response.data : {
+          ...response.data,
+          metadata: { ...previous.metadata, ...response.data.metadata },
+        });
         setCurrentFolder(folder);
         setError(null);
         setMetadataTextModalIsOpen(true);
@@ -246,7 +284,8 @@ function MainPage() {
   console.log('preview file ===>', previewFile)
 
   const renderMetadataTextModalContent = () => {
-    const { metadata = {}, text = {} } = metadataTextFiles;
+    const { metadata = {}, text = {}, total = 0 } = metadataTextFiles;
+    const loaded = Object.keys(metadata).length;
 
     return (
       <div>
@@ -257,6 +296,14 @@ function MainPage() {
             <pre>{JSON.stringify(content, null, 2)}</pre>
           </div>
         ))}
+        {loaded < total && (
+          <div>
+            <p>Showing {loaded} of {total} metadata records</p>
+            <Button variant='outlined' onClick={() => fetchMetadataAndTextFiles(currentFolder, metadataTextFiles.offset + metadataTextFiles.limit)} disabled={loading}>
+              Load more
+            </Button>
+          </div>
+        )}
         <h3>Text Files</h3>
         {Object.entries(text).map(([filename, content], index) => (
           <div key={index} className="text-file">
@@ -290,7 +337,7 @@ function MainPage() {
             </FormControl>
             <CustomFileUpload files={selectedFile} setFiles={handleFileChange} accept={fileType === 'HDF5' ? '.h5,.hdf5' : '.zip'} disabled={uploadingFileLoading || !fileType} />
             <Button onClick={handleUpload} variant="contained" style={{ width: '100%' }} disabled={!fileType || uploadingFileLoading}>
-              {uploadingFileLoading && <CircularProgress size={25}  style={{marginRight: '16px'}}/>} {uploadingFileLoading ? 'Uploading File' : 'Upload File'}
+              {uploadingFileLoading && <CircularProgress size={25}  style={{marginRight: '16px'}}/>} {uploadingFileLoading ? (uploadProgress === null ? 'Uploading File' : `Processing File ${uploadProgress}%`) : 'Upload File'}
             </Button>
           </div>
           <div className="output-section">
@@ -331,7 +378,7 @@ function MainPage() {
                               </>
                             : <>
                                 <td>
-                                  <span onClick={() => openModal(`http://127.0.0.1:5000/output-files/${file}`)} style={{ cursor: 'pointer', color: 'blue' }}>{file}</span>  
+                                  <span onClick={() => openModal(`http://127.0.0.1:5000/output-files/${file}?upload_id=${uploadId}`)} style={{ cursor: 'pointer', color: 'blue' }}>{file}</span>  
                                 </td>
                                 <td>
                                   <Tooltip title="Download File">
@@ -401,7 +448,7 @@ function MainPage() {
         <div style={{ textAlign: 'center' }}>
           {previewFile && (
             <div>
-              {previewFile.match(/.(jpeg|jpg|png|gif)$/i) ? (
+              {previewFile.match(/.(jpeg|jpg|png|gif)(\?.*)?$/i) ? (
                 <img src={previewFile} alt="Preview" style={{ maxWidth: '100%', maxHeight: '80vh' }} />
               ) : (
                 <iframe src={previewFile} style={{ width: '100%', height: '80vh' }} title="File Preview"></iframe>